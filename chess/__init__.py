@@ -1,6 +1,11 @@
+import chess.attacks
+import chess.bitboard
+import chess.fen
+import chess.instrument
+import chess.movegen
 import chess.pieces
+import chess.zobrist
 
-import copy
 import numpy as np
 
 
@@ -38,13 +43,32 @@ def coords_to_string(data: tuple):
 
 
 class Square:
-    def __init__(self, file: int, rank: int):
+    """One of the 64 squares.
+
+    There is exactly one instance per square, ``Square(file, rank)`` hands out
+    the shared one, so squares compare and hash by identity.
+    """
+
+    __slots__ = ("file", "rank", "index")
+
+    def __new__(cls, file: int, rank: int):
         if file < 1 or file > 8:
             raise InvalidSquareException(f"{file} is not a valid file")
         if rank < 1 or rank > 8:
             raise InvalidSquareException(f"{rank} is not a valid rank")
-        self.file = file
-        self.rank = rank
+        return SQUARES[(rank - 1) * 8 + (file - 1)]
+
+    @classmethod
+    def _create(cls, index: int):
+        square = object.__new__(cls)
+        square.file = (index & 7) + 1
+        square.rank = (index >> 3) + 1
+        square.index = index
+        return square
+
+    @staticmethod
+    def from_index(index: int):
+        return SQUARES[index]
 
     def delta(self, dx, dy):
         return Square(self.file + dx, self.rank + dy)
@@ -53,26 +77,71 @@ class Square:
         return (self.file, self.rank)
 
     def to_index(self):
-        return (self.rank - 1) * 8 + (self.file - 1)
+        return self.index
 
     def __str__(self):
-        file = chr(self.file - 1 + ord("a"))
-        return f"{file}{self.rank}"
+        return SQUARE_NAMES[self.index]
 
-    def __eq__(self, other):
-        if other is None:
-            return False
-        return self.rank == other.rank and self.file == other.file
+    def __repr__(self):
+        return f"Square({SQUARE_NAMES[self.index]})"
+
+    def __reduce__(self):
+        # unpickle to the shared instance
+        return (Square.from_index, (self.index,))
 
-    def __hash__(self):
-        return hash((self.rank, self.file))
+
+SQUARES = [Square._create(i) for i in range(64)]
+SQUARE_NAMES = [f"{chr(ord('a') + (i & 7))}{(i >> 3) + 1}" for i in range(64)]
+
+# Promotion piece letter to the 4 bits it takes up in a move code
+PROMOTION_CODES = {
+    None: 0,
+    "Q": 2,
+    "R": 3,
+    "B": 4,
+    "N": 5,
+    "q": 2,
+    "r": 3,
+    "b": 4,
+    "n": 5,
+}
+
+
+def encode_move(start: int, end: int, prom_code: int = 0):
+    """Packs a move in 16 bits: start index, end index << 6, promotion << 12"""
+    return start | (end << 6) | (prom_code << 12)
 
 
 class Move:
+    """A move from start to end, with the promotion piece letter if any.
+
+    Every move also has a 16 bit ``code`` (see encode_move) which is what it
+    hashes and compares by. Codes can be stored in arrays and turned back into
+    moves with ``Move.decode``.
+    """
+
+    __slots__ = ("start", "end", "prom", "code")
+
     def __init__(self, start: Square, end: Square, prom=None):
         self.start = start
         self.end = end
         self.prom = prom
+        self.code = encode_move(start.index, end.index, PROMOTION_CODES[prom or None])
+
+    @staticmethod
+    def decode(code: int):
+        """The move for a code, moves are shared between calls"""
+        move = _DECODED_MOVES.get(code)
+        if move is None:
+            prom = None
+            if code >> 12:
+                prom = pieces.PIECES[code >> 12]().fen
+                if code >> 6 & 63 < 8:
+                    # promoting on the first rank, so a black piece
+                    prom = prom.lower()
+            move = Move(SQUARES[code & 63], SQUARES[code >> 6 & 63], prom=prom)
+            _DECODED_MOVES[code] = move
+        return move
 
     def __str__(self):
         s = f"{self.start}{self.end}"
@@ -80,11 +149,19 @@ class Move:
             s += f"{self.prom}"
         return s
 
+    def __repr__(self):
+        return f"Move({self})"
+
     def __eq__(self, other):
-        return self.start == other.start and self.end == other.end
+        if not isinstance(other, Move):
+            return NotImplemented
+        return self.code == other.code
 
     def __hash__(self):
-        return hash((self.start, self.end, self.prom))
+        return self.code
+
+    def __int__(self):
+        return self.code
 
     @property
     def man_dist(self):
@@ -93,185 +170,317 @@ class Move:
         )
 
 
+_DECODED_MOVES = {}
+
+
 class Board:
+    """Position on the board, stored as bitboards.
+
+    ``bitboards`` holds one mask per piece code. The codes run from -6 to 6 so
+    black pieces simply index from the back of the list, ``bitboards[-1]`` is
+    the black king and ``bitboards[1]`` the white one. ``occupied_co`` works
+    the same way with the colours 1 and -1. ``mailbox`` mirrors the bitboards
+    as a list of piece codes for quick ``piece_at`` lookups and ``kings``
+    holds the index of each king, by colour as well. ``key`` is the zobrist
+    hash of the pieces. ``accumulator`` is an optional nnue.Accumulator that
+    is kept up to date with the pieces the same way as the key.
+    """
+
     def __init__(self, squares=None, fen=None):
-        self.squares = np.zeros((64), dtype=float)
+        self.bitboards = [0] * 13
+        self.occupied_co = [0, 0, 0]
+        self.occupied = 0
+        self.mailbox = [pieces.EMPTY_SQUARE] * 64
+        self.kings = [None, None, None]
+        self.key = 0
+        self.ep = None
+        self.accumulator = None
         if squares is not None:
             assert len(squares) == 64
-            self.squares = squares
+            self.set_squares(squares)
         elif fen:
             self.load_from_fen(fen)
         else:
             self.default_board()
-        self.white_in_check = False
-        self.black_in_check = False
+
+    def copy(self):
+        instrument.count("board.copy")
+        board = Board.__new__(Board)
+        board.bitboards = self.bitboards[:]
+        board.occupied_co = self.occupied_co[:]
+        board.occupied = self.occupied
+        board.mailbox = self.mailbox[:]
+        board.kings = self.kings[:]
+        board.key = self.key
+        board.ep = self.ep
+        board.accumulator = self.accumulator.copy() if self.accumulator is not None else None
+        return board
+
+    def put_piece(self, index: int, piece: int):
+        if self.mailbox[index] != pieces.EMPTY_SQUARE:
+            self.remove_piece(index)
+        mask = bitboard.BB_SQUARES[index]
+        self.bitboards[piece] |= mask
+        self.occupied_co[pieces.colour_of_piece(piece)] |= mask
+        self.occupied |= mask
+        self.mailbox[index] = piece
+        self.key ^= zobrist.PIECE_KEYS[piece][index]
+        if self.accumulator is not None:
+            self.accumulator.add(piece, index)
+        if piece == pieces.KING or piece == -pieces.KING:
+            self.kings[piece] = index
+
+    def remove_piece(self, index: int):
+        piece = self.mailbox[index]
+        if piece == pieces.EMPTY_SQUARE:
+            return piece
+        mask = bitboard.BB_SQUARES[index]
+        self.bitboards[piece] ^= mask
+        self.occupied_co[pieces.colour_of_piece(piece)] ^= mask
+        self.occupied ^= mask
+        self.mailbox[index] = pieces.EMPTY_SQUARE
+        self.key ^= zobrist.PIECE_KEYS[piece][index]
+        if self.accumulator is not None:
+            self.accumulator.sub(piece, index)
+        if piece == pieces.KING or piece == -pieces.KING:
+            self.kings[piece] = None
+        return piece
+
+    def clear(self):
+        self.bitboards = [0] * 13
+        self.occupied_co = [0, 0, 0]
+        self.occupied = 0
+        self.mailbox = [pieces.EMPTY_SQUARE] * 64
+        self.kings = [None, None, None]
+        self.key = 0
+        self.ep = None
+        if self.accumulator is not None:
+            self.accumulator.clear()
+
+    def set_squares(self, squares):
+        self.clear()
+        for i, piece in enumerate(squares):
+            piece = int(piece)
+            if piece == pieces.EN_PASSENT_TARGET:
+                self.ep = i
+            elif piece != pieces.EMPTY_SQUARE:
+                self.put_piece(i, piece)
+
+    @property
+    def squares(self):
+        """The board as 64 piece codes, en passent target included"""
+        squares = np.array(self.mailbox, dtype=float)
+        if self.ep is not None:
+            squares[self.ep] = pieces.EN_PASSENT_TARGET
+        return squares
+
+    def write_squares(self, out):
+        """Writes the squares view into the 64 long array out, in place"""
+        out[:] = self.mailbox
+        if self.ep is not None:
+            out[self.ep] = pieces.EN_PASSENT_TARGET
 
     def default_board(self):
+        self.clear()
         # pawns
         for i in range(8):
             # white
-            self.squares[8 + i] = pieces.PIECES_FENS["P"]
+            self.put_piece(8 + i, pieces.PIECES_FENS["P"])
             # black
-            self.squares[6 * 8 + i] = pieces.PIECES_FENS["p"]
+            self.put_piece(6 * 8 + i, pieces.PIECES_FENS["p"])
         # white pieces
-        self.squares[0] = pieces.PIECES_FENS["R"]
-        self.squares[1] = pieces.PIECES_FENS["N"]
-        self.squares[2] = pieces.PIECES_FENS["B"]
-        self.squares[3] = pieces.PIECES_FENS["Q"]
-        self.squares[4] = pieces.PIECES_FENS["K"]
-        self.squares[5] = pieces.PIECES_FENS["B"]
-        self.squares[6] = pieces.PIECES_FENS["N"]
-        self.squares[7] = pieces.PIECES_FENS["R"]
+        for i, fen in enumerate("RNBQKBNR"):
+            self.put_piece(i, pieces.PIECES_FENS[fen])
         # black pieces
-        self.squares[56 + 0] = pieces.PIECES_FENS["r"]
-        self.squares[56 + 1] = pieces.PIECES_FENS["n"]
-        self.squares[56 + 2] = pieces.PIECES_FENS["b"]
-        self.squares[56 + 3] = pieces.PIECES_FENS["q"]
-        self.squares[56 + 4] = pieces.PIECES_FENS["k"]
-        self.squares[56 + 5] = pieces.PIECES_FENS["b"]
-        self.squares[56 + 6] = pieces.PIECES_FENS["n"]
-        self.squares[56 + 7] = pieces.PIECES_FENS["r"]
-
-    def fen(self):
-        fen = ""
-        for y in range(8):
-            empty_count = 0
-            for x in range(8):
-                if self.squares[8 * y + x] == pieces.EMPTY_SQUARE:
-                    empty_count += 1
-                else:
-                    if empty_count > 0:
-                        fen += f"{empty_count}"
-                        empty_count = 0
-                    fen += pieces.PIECES[self.squares[8 * y + x]]().fen
-            if empty_count > 0:
-                fen += f"{empty_count}"
-            fen += "/"
-        return fen
-
-    def load_from_fen(self, fen):
-        rows = fen.split("/")
+        for i, fen in enumerate("rnbqkbnr"):
+            self.put_piece(56 + i, pieces.PIECES_FENS[fen])
+
+    def fen(self, standard=False):
+        """The board part of a FEN, see fen.board_fen"""
+        return fen.board_fen(self.mailbox, self.ep, standard)
+
+    def load_from_fen(self, board_fen):
         squares = []
-        for row in rows:
+        for row in board_fen.split("/"):
             for char in row:
-                if "1" <= char <= "8":
-                    for _ in range(int(char)):
-                        squares.append(pieces.EMPTY_SQUARE)
+                code = pieces.PIECES_FENS.get(char)
+                if code is None:
+                    squares += FEN_EMPTY_RUNS[char]
                 else:
-                    squares.append(pieces.PIECES_FENS[char])
+                    squares.append(code)
         assert len(squares) == 64
-        self.squares = squares
+        self.set_squares(squares)
 
     def piece_at(self, square: Square):
-        return self.squares[square.to_index()]
+        return self.mailbox[square.to_index()]
 
     def set_en_passent(self, square: Square):
-        self.squares[square.to_index()] = 7
+        self.ep = square.to_index()
 
     def remove_en_passent(self):
-        for i in range(len(self.squares)):
-            if self.squares[i] == 7:
-                self.squares[i] = pieces.EMPTY_SQUARE
+        self.ep = None
+
+    def attacks_by(self, col, occupied=None):
+        """Bitboard of every square attacked by the pieces of col.
+
+        Sliding pieces are blocked by occupied, which defaults to the pieces
+        on the board.
+        """
+        bbs = self.bitboards
+        if occupied is None:
+            occupied = self.occupied
+        pawns = bbs[pieces.PAWN * col]
+        if col == 1:
+            attacked = ((pawns & ~bitboard.FILE_A) << 7) | ((pawns & ~bitboard.FILE_H) << 9)
+            attacked &= bitboard.FULL
+        else:
+            attacked = ((pawns & ~bitboard.FILE_A) >> 9) | ((pawns & ~bitboard.FILE_H) >> 7)
+        for i in bitboard.scan(bbs[pieces.KNIGHT * col]):
+            attacked |= attacks.KNIGHT_ATTACKS[i]
+        for i in bitboard.scan(bbs[pieces.BISHOP * col] | bbs[pieces.QUEEN * col]):
+            attacked |= attacks.bishop_attacks(i, occupied)
+        for i in bitboard.scan(bbs[pieces.ROOK * col] | bbs[pieces.QUEEN * col]):
+            attacked |= attacks.rook_attacks(i, occupied)
+        for i in bitboard.scan(bbs[pieces.KING * col]):
+            attacked |= attacks.KING_ATTACKS[i]
+        return attacked
+
+    def attackers_to(self, index: int, col, occupied=None):
+        """Bitboard of the pieces of col attacking the square index"""
+        bbs = self.bitboards
+        if occupied is None:
+            occupied = self.occupied
+        queens = bbs[pieces.QUEEN * col]
+        return (
+            (attacks.KNIGHT_ATTACKS[index] & bbs[pieces.KNIGHT * col])
+            | (attacks.KING_ATTACKS[index] & bbs[pieces.KING * col])
+            | (attacks.PAWN_ATTACKS[-col][index] & bbs[pieces.PAWN * col])
+            | (attacks.bishop_attacks(index, occupied) & (bbs[pieces.BISHOP * col] | queens))
+            | (attacks.rook_attacks(index, occupied) & (bbs[pieces.ROOK * col] | queens))
+        ) & occupied
+
+    def insufficient_material(self):
+        """Whether neither side can mate: only kings and at most one minor
+        piece, or only bishops that all stand on squares of one colour"""
+        bbs = self.bitboards
+        if bbs[pieces.PAWN] | bbs[-pieces.PAWN] | bbs[pieces.ROOK] | bbs[-pieces.ROOK]:
+            return False
+        if bbs[pieces.QUEEN] | bbs[-pieces.QUEEN]:
+            return False
+        knights = bbs[pieces.KNIGHT] | bbs[-pieces.KNIGHT]
+        bishops = bbs[pieces.BISHOP] | bbs[-pieces.BISHOP]
+        if (knights | bishops).bit_count() <= 1:
+            return True
+        return not knights and (not bishops & bitboard.DARK_SQUARES or not bishops & ~bitboard.DARK_SQUARES)
 
     def threats(self, col):
-        threats = set()
-        for file in range(1, 9):
-            for rank in range(1, 9):
-                square = Square(file, rank)
-                piece = self.piece_at(square)
-                if piece == pieces.EMPTY_SQUARE:
-                    continue
-                if col != pieces.colour_of_piece(piece):
-                    continue
-                piece_o = pieces.PIECES[piece]()
-                threats.update(piece_o.threat_squares(self, square))
-        return threats
+        return pieces.squares_of(self.attacks_by(col) & ~self.occupied_co[col])
+
+    def king_square(self, col):
+        king = self.kings[col]
+        if king is None:
+            return None
+        return Square.from_index(king)
+
+    def is_square_attacked(self, square: Square, by_colour):
+        return self.attackers_to(square.to_index(), by_colour) != 0
+
+    def is_check(self, col):
+        """Whether the king of col is attacked"""
+        king = self.kings[col]
+        return king is not None and self.attackers_to(king, -col) != 0
+
+    @property
+    def white_in_check(self):
+        return self.is_check(1)
+
+    @property
+    def black_in_check(self):
+        return self.is_check(-1)
 
     def check_check(self):
-        self.white_in_check = False
-        self.black_in_check = False
-        white_threats = set()
-        black_threats = set()
-        white_sq = None
-        black_sq = None
-        for file in range(1, 9):
-            for rank in range(1, 9):
-                square = Square(file, rank)
-                piece = self.piece_at(square)
-                if piece == pieces.EMPTY_SQUARE:
-                    continue
-                piece_o = pieces.PIECES[piece]()
-                if isinstance(piece_o, pieces.WhiteKing):
-                    white_sq = square
-                if isinstance(piece_o, pieces.BlackKing):
-                    black_sq = square
-                colour = pieces.colour_of_piece(piece)
-                threats = piece_o.threat_squares(self, square)
-                if colour == 1:
-                    white_threats.update(threats)
-                else:
-                    black_threats.update(threats)
-        if white_sq in black_threats:
-            self.white_in_check = True
-        if black_sq in white_threats:
-            self.black_in_check = True
-
-    def board_after_move(self, move, en_passent):
-        new_board_squares = copy.deepcopy(self.squares)
+        """Check is worked out when it is asked for, nothing to do here anymore"""
+        pass
+
+    def make_move(self, move):
+        """Plays move on this board in place.
+
+        Takes en passent against the target in ``ep`` and moves the rook along
+        when castling. Returns the (piece, captured, captured_index) that
+        ``unmake_move`` needs to take the move back.
+        """
         start_i = move.start.to_index()
         end_i = move.end.to_index()
+        piece = self.remove_piece(start_i)
+        captured_i = end_i
+        if abs(piece) == pieces.PAWN and end_i == self.ep:
+            # the pawn taken en passent is behind the target square
+            captured_i = end_i - 8 * pieces.colour_of_piece(piece)
+        captured = self.remove_piece(captured_i)
         if move.prom:
-            piece = move.prom
+            self.put_piece(end_i, pieces.PIECES_FENS[move.prom.upper()] * pieces.colour_of_piece(piece))
         else:
-            piece = new_board_squares[start_i]
-        new_board_squares[end_i] = piece
-        new_board_squares[start_i] = pieces.EMPTY_SQUARE
+            self.put_piece(end_i, piece)
 
-        piece_o = pieces.PIECES[piece]()
         # Castle rules
-        if isinstance(piece_o, pieces.King):
-            if abs(move.end.file - move.start.file) == 2:
-                if move.end.rank == 8:
-                    if move.end.file == 3:
-                        rook_start = Square(1, 8).to_index()
-                        rook_end = Square(4, 8).to_index()
-                    elif move.end.file == 7:
-                        rook_start = Square(8, 8).to_index()
-                        rook_end = Square(6, 8).to_index()
-                    else:
-                        raise InvalidCastleException("You cannot castle there!")
-                elif move.end.rank == 1:
-                    if move.end.file == 3:
-                        rook_start = Square(1, 1).to_index()
-                        rook_end = Square(4, 1).to_index()
-                    elif move.end.file == 7:
-                        rook_start = Square(8, 1).to_index()
-                        rook_end = Square(6, 1).to_index()
-                    else:
-                        raise InvalidCastleException("You cannot castle there!")
-                else:
-                    raise InvalidCastleException("You cannot castle there!")
-                r = new_board_squares[rook_start]
-                new_board_squares[rook_end] = r
-                new_board_squares[rook_start] = pieces.EMPTY_SQUARE
-
-        # En passent rules
-        if move.end == en_passent:
-            if en_passent.rank == 3:
-                # take the pawn (black takes ep)
-                taken_i = Square(move.end.file, 3).to_index()
-            elif en_passent.rank == 6:
-                # take the pawn (white takes ep)
-                taken_i = Square(move.end.file, 6).to_index()
-            else:
-                raise InvalidEnPassentException()
-            new_board_squares[taken_i] = pieces.EMPTY_SQUARE
-        new_board = Board(squares=new_board_squares)
-        new_board.check_check()
-        return new_board
+        if abs(piece) == pieces.KING and abs(end_i - start_i) == 2:
+            rook_start, rook_end = self.castle_rook_squares(move)
+            self.put_piece(rook_end, self.remove_piece(rook_start))
+        return piece, captured, captured_i
+
+    def unmake_move(self, move, piece, captured, captured_i):
+        start_i = move.start.to_index()
+        end_i = move.end.to_index()
+        self.remove_piece(end_i)
+        self.put_piece(start_i, piece)
+        if captured != pieces.EMPTY_SQUARE:
+            self.put_piece(captured_i, captured)
+        if abs(piece) == pieces.KING and abs(end_i - start_i) == 2:
+            rook_start, rook_end = self.castle_rook_squares(move)
+            self.put_piece(rook_start, self.remove_piece(rook_end))
+
+    @staticmethod
+    def castle_rook_squares(move):
+        if move.start.file != 5 or move.end.rank not in (1, 8):
+            raise InvalidCastleException("You cannot castle there!")
+        if move.end.file == 3:
+            return Square(1, move.end.rank).to_index(), Square(4, move.end.rank).to_index()
+        if move.end.file == 7:
+            return Square(8, move.end.rank).to_index(), Square(6, move.end.rank).to_index()
+        raise InvalidCastleException("You cannot castle there!")
+
+
+# The empty squares a digit in a FEN stands for
+FEN_EMPTY_RUNS = {str(n): [pieces.EMPTY_SQUARE] * n for n in range(1, 9)}
+
+# Castle rights lost when a move starts or ends on the square
+CASTLE_RIGHTS_LOST = {
+    Square(1, 1).to_index(): "Q",
+    Square(5, 1).to_index(): "KQ",
+    Square(8, 1).to_index(): "K",
+    Square(1, 8).to_index(): "q",
+    Square(5, 8).to_index(): "kq",
+    Square(8, 8).to_index(): "k",
+}
 
 
 class Game:
+    """A position with the side on move and the state the rules need.
+
+    The legal moves and whether there are any are worked out at most once
+    per position, the first time they are asked for, and forgotten when a
+    move is pushed. pop brings back what was known before the push.
+
+    ``history`` holds the key of every position of the game so far, the
+    current one last, and ``repetitions`` how often each key occurs in it,
+    so repetitions are a dict lookup. Keys include the side on move, castle
+    rights and en passent, so positions on either side of an irreversible
+    move never share one.
+    """
+
+    # fifty moves by each side, in plies
+    FIFTY_MOVE_PLIES = 100
+
     def __init__(self, fen=None):
         self.board = Board()
         self.on_move = 1
@@ -279,10 +488,27 @@ class Game:
         self.en_passent = None
         self.fifty_mr = 0
         self.full_move_count = 1
+        # (move, piece, captured, captured index, castles, en passent,
+        # fifty move counter, state key, legal codes, has moves) for every
+        # pushed move
+        self.undo_stack = []
+        # legal move codes and whether there are any, None until asked for
+        self._legal_codes = None
+        self._has_moves = None
         if fen:
-            board, on_move, castles, en_passent, fifty_mr, mc = fen.split(" ")
+            instrument.count("fen.parse")
+            # EPD lines and some FENs leave out the move counters
+            fields = fen.split()
+            if len(fields) > 4 and not fields[4].isdigit():
+                fields = fields[:4]
+            fields += ["0", "1"][len(fields) - 4 :]
+            board, on_move, castles, en_passent, fifty_mr, mc = fields[:6]
+            if on_move in ("w", "b"):
+                # standard FEN, ranks run from 8 down to 1
+                board = "/".join(reversed(board.split("/")))
+                on_move = 1 if on_move == "w" else -1
             self.board = Board(fen=board)
-            self.on_move = on_move
+            self.on_move = int(on_move)
             for s in self.castles.keys():
                 self.castles[s] = s in castles
             if en_passent != "-":
@@ -291,208 +517,196 @@ class Game:
                 self.board.set_en_passent(self.en_passent)
             self.fifty_mr = int(fifty_mr)
             self.full_move_count = int(mc)
-
-    def fen(self):
+        # zobrist hash of everything but the pieces, see key
+        self.state_key = zobrist.state_key(self)
+        self.history = [self.key]
+        self.repetitions = {self.key: 1}
+
+    def fen(self, standard=False):
+        """FEN in this package's own format, or the standard one with ranks 8
+        to 1 and w or b on move when standard=True"""
+        instrument.count("fen.write")
         ep_str = self.en_passent or "-"
-        castles_str = ""
-        for s, v in self.castles.items():
-            if v:
-                castles_str += s
-        if len(castles_str) < 1:
-            castles_str = "-"
-        return f"{self.board.fen()} {self.on_move} {castles_str} {ep_str} {self.fifty_mr} {self.full_move_count}"
+        castles_str = "".join(right for right, allowed in self.castles.items() if allowed) or "-"
+        on_move = ("w" if self.on_move == 1 else "b") if standard else self.on_move
+        return f"{self.board.fen(standard)} {on_move} {castles_str} {ep_str} {self.fifty_mr} {self.full_move_count}"
 
     def legal_moves(self, piece, start):
-        piece_o = pieces.PIECES[piece]()
-        ends = set()
-        p_ends = piece_o.move_squares(self.board, start)
-        p_threat_ends = piece_o.threat_squares(self.board, start)
-        ends.update(p_ends)
-        for end in p_threat_ends - p_ends:
-            if self.board.piece_at(end) != pieces.EMPTY_SQUARE:
-                ends.add(end)
-            if self.en_passent == end:
-                if isinstance(piece_o, pieces.Pawn):
-                    ends.add(end)
-        other_colour = piece_o.colour * -1
-        other_threats = self.board.threats(other_colour)
-        if (
-            isinstance(piece_o, pieces.BlackKing) and not self.board.black_in_check
-        ) or (isinstance(piece_o, pieces.WhiteKing) and not self.board.white_in_check):
-
-            def can_castle_through(square):
-                return (
-                    self.board.piece_at(square) is None and square not in other_threats
-                )
-
-            if isinstance(piece_o, pieces.WhiteKing):
-                if self.castles["K"]:
-                    if (
-                        can_castle_through(Square(3, 1))
-                        and can_castle_through(Square(4, 1))
-                        and self.board.piece_at(Square(2, 1)) is None
-                    ):
-                        ends.add(Square(3, 1))
-                if self.castles["Q"]:
-                    if can_castle_through(Square(6, 1)) and can_castle_through(
-                        Square(7, 1)
-                    ):
-                        ends.add(Square(7, 1))
-            if isinstance(piece_o, pieces.BlackKing):
-                if self.castles["k"]:
-                    if (
-                        can_castle_through(Square(3, 8))
-                        and can_castle_through(Square(4, 8))
-                        and self.board.piece_at(Square(2, 8)) is None
-                    ):
-                        ends.add(Square(3, 8))
-                if self.castles["q"]:
-                    if can_castle_through(Square(6, 8)) and can_castle_through(
-                        Square(7, 8)
-                    ):
-                        ends.add(Square(7, 8))
-        moves = []
-        if piece_o.colour == 1:
-            for end in ends:
-                if isinstance(piece_o, pieces.WhitePawn) and end.rank == 8:
-                    # Promotion to Queen
-                    if not self.board.board_after_move(
-                        Move(start, end, prom="Q"), self.en_passent
-                    ).white_in_check:
-                        moves.append(Move(start, end, prom="Q"))
-                    # Promotion to rook
-                    if not self.board.board_after_move(
-                        Move(start, end, prom="R"), self.en_passent
-                    ).white_in_check:
-                        moves.append(Move(start, end, prom="R"))
-                    # Promotion to Bishop
-                    if not self.board.board_after_move(
-                        Move(start, end, prom="B"), self.en_passent
-                    ).white_in_check:
-                        moves.append(Move(start, end, prom="B"))
-                    # Promotion to knight
-                    if not self.board.board_after_move(
-                        Move(start, end, prom="N"), self.en_passent
-                    ).white_in_check:
-                        moves.append(Move(start, end, prom="N"))
-                else:
-                    if not self.board.board_after_move(
-                        Move(start, end), self.en_passent
-                    ).white_in_check:
-                        moves.append(Move(start, end))
-        else:
-            for end in ends:
-                if isinstance(piece_o, pieces.BlackPawn) and end.rank == 1:
-                    # Promotion to Queen
-                    if not self.board.board_after_move(
-                        Move(start, end, prom="q"), self.en_passent
-                    ).black_in_check:
-                        moves.append(Move(start, end, prom="q"))
-                    # Promotion to rook
-                    if not self.board.board_after_move(
-                        Move(start, end, prom="r"), self.en_passent
-                    ).black_in_check:
-                        moves.append(Move(start, end, prom="r"))
-                    # Promotion to Bishop
-                    if not self.board.board_after_move(
-                        Move(start, end, prom="b"), self.en_passent
-                    ).black_in_check:
-                        moves.append(Move(start, end, prom="b"))
-                    # Promotion to knight
-                    if not self.board.board_after_move(
-                        Move(start, end, prom="n"), self.en_passent
-                    ).black_in_check:
-                        moves.append(Move(start, end, prom="n"))
-                else:
-                    if not self.board.board_after_move(
-                        Move(start, end), self.en_passent
-                    ).black_in_check:
-                        moves.append(Move(start, end))
-        return moves
+        """The legal moves of the piece on start"""
+        return movegen.legal_moves(self, bitboard.BB_SQUARES[start.to_index()])
+
+    def legal_codes(self):
+        """The legal move codes of the position, as a tuple"""
+        if self._legal_codes is None:
+            self._legal_codes = tuple(movegen.legal_codes(self))
+            self._has_moves = len(self._legal_codes) > 0
+        return self._legal_codes
 
     def generate_moves(self):
-        print(self.en_passent)
-        moves = set()
-        for i in range(len(self.board.squares)):
-            x = (i % 8) + 1
-            y = (i // 8) + 1
-            start = Square(x, y)
-            piece = self.board.piece_at(start)
-            if piece == pieces.EMPTY_SQUARE:
-                continue
-            if pieces.PIECES[piece]().colour != self.on_move:
-                continue
-            moves.update(self.legal_moves(piece, start))
-        return moves
+        decode = Move.decode
+        return {decode(code) for code in self.legal_codes()}
+
+    def staged_moves(self, hash_move: Move = None):
+        """Yields the legal moves a stage at a time, see movegen.staged_codes"""
+        decode = Move.decode
+        for code in movegen.staged_codes(self, hash_move.code if hash_move is not None else None):
+            yield decode(code)
+
+    def has_legal_moves(self):
+        """Whether the side on move can move, without generating every move"""
+        if self._has_moves is None:
+            self._has_moves = movegen.has_legal_move(self)
+        return self._has_moves
+
+    def is_checkmate(self):
+        return not self.has_legal_moves() and self.in_check
+
+    def is_stalemate(self):
+        return not self.has_legal_moves() and not self.in_check
+
+    def copy(self):
+        instrument.count("game.copy")
+        game = Game.__new__(Game)
+        game.board = self.board.copy()
+        game.on_move = self.on_move
+        game.castles = self.castles.copy()
+        game.en_passent = self.en_passent
+        game.fifty_mr = self.fifty_mr
+        game.full_move_count = self.full_move_count
+        game.undo_stack = self.undo_stack[:]
+        game.state_key = self.state_key
+        game.history = self.history[:]
+        game.repetitions = self.repetitions.copy()
+        game._legal_codes = self._legal_codes
+        game._has_moves = self._has_moves
+        return game
+
+    def push(self, move: Move):
+        """Plays move in place, it can be taken back with pop"""
+        board = self.board
+        # the old dict goes on the undo stack as it is and is never changed
+        # again, copies of this game share the stack
+        undo = (
+            self.castles,
+            self.en_passent,
+            self.fifty_mr,
+            self.state_key,
+            self._legal_codes,
+            self._has_moves,
+        )
+        self._legal_codes = None
+        self._has_moves = None
+        self.castles = self.castles.copy()
+        key = self.state_key ^ zobrist.SIDE_KEY ^ zobrist.ep_key(board, board.ep, self.on_move)
+        piece, captured, captured_i = board.make_move(move)
+        self.undo_stack.append((move, piece, captured, captured_i) + undo)
 
-    def move(self, move: Move):
-        piece = self.board.piece_at(move.start)
-        new_game = Game(self.fen())
-        capture = False
-        if new_game.board.piece_at(move.end) != pieces.EMPTY_SQUARE:
-            capture = True
-        new_game.board = new_game.board.board_after_move(move, self.en_passent)
-        new_game.board.check_check()
-
-        piece_o = pieces.PIECES[piece]()
         # on_move changes and 50 mr
-        new_game.on_move = self.on_move * -1
-        if new_game.on_move == 1:
-            new_game.full_move_count += 1
-        new_game.en_passent = None
-        new_game.board.remove_en_passent()
-        if isinstance(piece_o, pieces.Pawn):
-            new_game.fifty_mr = 0
+        self.on_move *= -1
+        if self.on_move == 1:
+            self.full_move_count += 1
+        self.en_passent = None
+        board.remove_en_passent()
+        if abs(piece) == pieces.PAWN:
+            self.fifty_mr = 0
             if move.end.rank - move.start.rank == 2:
-                new_game.en_passent = move.start.delta(0, 1)
-                new_game.board.set_en_passent(new_game.en_passent)
+                self.en_passent = move.start.delta(0, 1)
+                board.set_en_passent(self.en_passent)
             elif move.end.rank - move.start.rank == -2:
-                new_game.en_passent = move.start.delta(0, -1)
-                new_game.board.set_en_passent(new_game.en_passent)
-        elif capture:
-            new_game.fifty_mr = 0
+                self.en_passent = move.start.delta(0, -1)
+                board.set_en_passent(self.en_passent)
+        elif captured != pieces.EMPTY_SQUARE:
+            self.fifty_mr = 0
+        else:
+            self.fifty_mr += 1
+
+        if self.en_passent:
+            key ^= zobrist.ep_key(board, board.ep, self.on_move)
+
+        # update castle rights, moving from or capturing on a king or rook
+        # square loses them
+        for index in (move.start.to_index(), move.end.to_index()):
+            for right in CASTLE_RIGHTS_LOST.get(index, ""):
+                if self.castles[right]:
+                    self.castles[right] = False
+                    key ^= zobrist.CASTLE_KEYS[right]
+        self.state_key = key
+
+        key = board.key ^ key
+        self.history.append(key)
+        self.repetitions[key] = self.repetitions.get(key, 0) + 1
+
+    def pop(self):
+        """Takes back the last pushed move and returns it"""
+        key = self.history.pop()
+        count = self.repetitions[key] - 1
+        if count:
+            self.repetitions[key] = count
         else:
-            new_game.fifty_mr += 1
-
-        # update castle rights
-        if isinstance(piece_o, pieces.BlackRook):
-            if move.start.file == 1:
-                new_game.castles["q"] = False
-            elif move.start.file == 8:
-                new_game.castles["k"] = False
-        elif isinstance(piece_o, pieces.BlackKing):
-            new_game.castles["q"] = False
-            new_game.castles["k"] = False
-        elif isinstance(piece_o, pieces.WhiteRook):
-            if move.start.file == 1:
-                new_game.castles["Q"] = False
-            elif move.start.file == 8:
-                new_game.castles["K"] = False
-        elif isinstance(piece_o, pieces.WhiteKing):
-            new_game.castles["Q"] = False
-            new_game.castles["K"] = False
+            del self.repetitions[key]
+        (
+            move,
+            piece,
+            captured,
+            captured_i,
+            self.castles,
+            self.en_passent,
+            self.fifty_mr,
+            self.state_key,
+            self._legal_codes,
+            self._has_moves,
+        ) = self.undo_stack.pop()
+        board = self.board
+        board.ep = self.en_passent.to_index() if self.en_passent else None
+        board.unmake_move(move, piece, captured, captured_i)
+        if self.on_move == 1:
+            self.full_move_count -= 1
+        self.on_move *= -1
+        return move
 
+    def move(self, move: Move):
+        """Returns a new game with move played, this game is left as is"""
+        new_game = self.copy()
+        new_game.push(move)
         return new_game
 
+    @property
+    def key(self):
+        """64 bit zobrist hash of the position"""
+        return self.board.key ^ self.state_key
+
     @property
     def in_check(self):
-        if self.on_move == 1:
-            return self.board.white_in_check
-        else:
-            return self.board.black_in_check
+        return self.board.is_check(self.on_move)
+
+    def repetition_count(self):
+        """How often the current position occurred in the game, itself included"""
+        return self.repetitions[self.history[-1]]
+
+    def is_repetition(self, count=3):
+        return self.repetitions[self.history[-1]] >= count
+
+    def is_fifty_moves(self):
+        return self.fifty_mr >= self.FIFTY_MOVE_PLIES
+
+    def is_insufficient_material(self):
+        return self.board.insufficient_material()
+
+    def is_draw(self):
+        """Drawn by threefold repetition, the fifty move rule or insufficient
+        material, stalemate is left to is_stalemate"""
+        return self.is_repetition(3) or self.is_fifty_moves() or self.is_insufficient_material()
 
     @property
     def game_over(self):
-        return len(self.generate_moves()) < 1 or self.fifty_mr >= 50
+        return not self.has_legal_moves() or self.is_draw()
 
     def result(self):
-        if self.fifty_mr >= 50:
-            return 0
-        if len(self.generate_moves()) < 1:
-            if self.on_move == 1:
-                if self.board.black_in_check:
-                    return 1
-            else:
-                if self.board.white_in_check:
-                    return -1
+        """1 when white won, -1 when black won, 0 for a draw and None while
+        the game goes on"""
+        if not self.has_legal_moves():
+            # mate before the fifty move rule, the side on move lost
+            return -self.on_move if self.in_check else 0
+        if self.is_draw():
             return 0
+        return None
@@ -0,0 +1,154 @@
+"""Precomputed attack tables.
+
+Knights, kings and pawns get one attack bitboard per square. Sliding pieces
+are looked up per line: for every square and every line through it (rank,
+file, diagonal and anti-diagonal) there is a dict from the blockers on that
+line to the squares attacked along it. Blockers on the edge of the board
+never change the attacks, so they are left out of the key which keeps every
+dict at 64 entries at most. All tables are built once at import.
+"""
+
+from chess.bitboard import BB_SQUARES
+
+
+def _on_board(file, rank):
+    return 0 <= file < 8 and 0 <= rank < 8
+
+
+def _step_attacks(index, deltas):
+    file, rank = index & 7, index >> 3
+    attacks = 0
+    for dx, dy in deltas:
+        if _on_board(file + dx, rank + dy):
+            attacks |= BB_SQUARES[(rank + dy) * 8 + file + dx]
+    return attacks
+
+
+def _ray(index, dx, dy, occupied=0):
+    """Squares from index in direction (dx, dy) up to and including a blocker"""
+    file, rank = (index & 7) + dx, (index >> 3) + dy
+    ray = 0
+    while _on_board(file, rank):
+        mask = BB_SQUARES[rank * 8 + file]
+        ray |= mask
+        if occupied & mask:
+            break
+        file += dx
+        rank += dy
+    return ray
+
+
+def _subsets(mask):
+    """All subsets of mask (carry rippler)"""
+    subset = 0
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if subset == 0:
+            return
+
+
+KNIGHT_DELTAS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+KING_DELTAS = ((1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1))
+
+KNIGHT_ATTACKS = [_step_attacks(i, KNIGHT_DELTAS) for i in range(64)]
+KING_ATTACKS = [_step_attacks(i, KING_DELTAS) for i in range(64)]
+# Indexed by colour, PAWN_ATTACKS[1] for white and PAWN_ATTACKS[-1] for black
+PAWN_ATTACKS = [
+    None,
+    [_step_attacks(i, ((1, 1), (-1, 1))) for i in range(64)],
+    [_step_attacks(i, ((1, -1), (-1, -1))) for i in range(64)],
+]
+
+# The lines through a square, as the pair of opposite directions along it
+LINES = (
+    ((1, 0), (-1, 0)),
+    ((0, 1), (0, -1)),
+    ((1, 1), (-1, -1)),
+    ((1, -1), (-1, 1)),
+)
+
+
+def _ray_end(index, dx, dy):
+    """The last square of the ray from index, a blocker there changes nothing"""
+    ray = _ray(index, dx, dy)
+    if not ray:
+        return 0
+    if dx + dy * 8 > 0:
+        return 1 << (ray.bit_length() - 1)
+    return ray & -ray
+
+
+def _line_tables(directions):
+    masks = []
+    tables = []
+    for i in range(64):
+        mask = 0
+        for dx, dy in directions:
+            mask |= _ray(i, dx, dy) & ~_ray_end(i, dx, dy)
+        table = {}
+        for blockers in _subsets(mask):
+            attacks = 0
+            for dx, dy in directions:
+                attacks |= _ray(i, dx, dy, blockers)
+            table[blockers] = attacks
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+RANK_MASKS, RANK_ATTACKS = _line_tables(LINES[0])
+FILE_MASKS, FILE_ATTACKS = _line_tables(LINES[1])
+DIAG_MASKS, DIAG_ATTACKS = _line_tables(LINES[2])
+ANTI_DIAG_MASKS, ANTI_DIAG_ATTACKS = _line_tables(LINES[3])
+
+
+def rook_attacks(index: int, occupied: int):
+    return (
+        RANK_ATTACKS[index][occupied & RANK_MASKS[index]]
+        | FILE_ATTACKS[index][occupied & FILE_MASKS[index]]
+    )
+
+
+def bishop_attacks(index: int, occupied: int):
+    return (
+        DIAG_ATTACKS[index][occupied & DIAG_MASKS[index]]
+        | ANTI_DIAG_ATTACKS[index][occupied & ANTI_DIAG_MASKS[index]]
+    )
+
+
+def queen_attacks(index: int, occupied: int):
+    return rook_attacks(index, occupied) | bishop_attacks(index, occupied)
+
+
+def _line_masks():
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for i in range(64):
+        for directions in LINES:
+            full = 0
+            for dx, dy in directions:
+                full |= _ray(i, dx, dy)
+            for dx, dy in directions:
+                ray = 0
+                for j in _ray_squares(i, dx, dy):
+                    between[i][j] = ray
+                    line[i][j] = full | BB_SQUARES[i]
+                    ray |= BB_SQUARES[j]
+    return between, line
+
+
+def _ray_squares(index, dx, dy):
+    file, rank = (index & 7) + dx, (index >> 3) + dy
+    while _on_board(file, rank):
+        yield rank * 8 + file
+        file += dx
+        rank += dy
+
+
+# BETWEEN[a][b] holds the squares strictly between a and b and LINE[a][b] the
+# whole rank, file or diagonal through both, both are empty when a and b do
+# not share a line.
+BETWEEN, LINE = _line_masks()
+ROOK_RAYS = [rook_attacks(i, 0) for i in range(64)]
+BISHOP_RAYS = [bishop_attacks(i, 0) for i in range(64)]
@@ -0,0 +1,32 @@
+"""Bitboard helpers.
+
+A bitboard is a python int used as a 64 bit mask, bit i is set when square i
+is in the set. Squares are indexed like ``Square.to_index``: a1 = 0, h1 = 7,
+a8 = 56 and h8 = 63.
+"""
+
+FULL = 0xFFFF_FFFF_FFFF_FFFF
+EMPTY = 0
+
+FILE_A = 0x0101_0101_0101_0101
+FILE_H = FILE_A << 7
+RANK_1 = 0xFF
+RANK_2 = RANK_1 << 8
+RANK_3 = RANK_1 << 16
+RANK_4 = RANK_1 << 24
+RANK_5 = RANK_1 << 32
+RANK_6 = RANK_1 << 40
+RANK_7 = RANK_1 << 48
+RANK_8 = RANK_1 << 56
+
+DARK_SQUARES = 0xAA55_AA55_AA55_AA55
+
+BB_SQUARES = [1 << i for i in range(64)]
+
+
+def scan(bb: int):
+    """Yields the index of every set bit, lowest first"""
+    while bb:
+        bit = bb & -bb
+        yield bit.bit_length() - 1
+        bb ^= bit
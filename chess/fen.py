@@ -0,0 +1,288 @@
+"""Reading and writing FENs in bulk.
+
+``decode`` turns a whole buffer of FEN or EPD lines into arrays at once: the
+bytes are classified with lookup tables, fields and squares are found with
+cumulative sums, there is no Python loop per line or per character. Both the
+standard format (ranks 8 to 1, side as w or b) and the one of Game.fen (ranks
+1 to 8 with a trailing slash, side as 1 or -1, an E on the en passent square)
+are read, line by line, so files may even mix them. EPD lines have no move
+counters, and anything after the en passent field that is not a number (EPD
+operations) is ignored.
+
+``load`` reads a file in chunks of CHUNK_BYTES cut after a newline, as the
+arrays of ``decode`` take several times the size of their buffer.
+
+``board_fen`` and ``fens`` go the other way with a table from piece code to
+letter instead of a piece object per square.
+"""
+
+import numpy as np
+
+import chess
+from chess import instrument, pieces
+
+# Piece letter of every code, indexed like Board.bitboards (so by negative
+# codes for black), empty squares as "1" until the runs are counted
+FEN_CHARS = ["1"] * 14
+for _fen, _code in pieces.PIECES_FENS.items():
+    FEN_CHARS[_code] = _fen
+# Runs of empty squares, longest first
+EMPTY_RUNS = [("1" * n, str(n)) for n in range(8, 1, -1)]
+
+CASTLE_BITS = {"K": 1, "Q": 2, "k": 4, "q": 8}
+
+# Lookup tables over the byte values
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b" \t\r\n;")] = True
+_PIECE_CODES = np.zeros(256, dtype=np.int8)
+_IS_PIECE = np.zeros(256, dtype=bool)
+for _fen, _code in pieces.PIECES_FENS.items():
+    _PIECE_CODES[ord(_fen)] = _code
+    _IS_PIECE[ord(_fen)] = True
+# Squares a board character takes up, -1 where it is not a board character
+_WIDTHS = np.full(256, -1, dtype=np.int32)
+_WIDTHS[_IS_PIECE] = 1
+_WIDTHS[ord("/")] = 0
+_WIDTHS[list(b"12345678")] = np.arange(1, 9)
+_CASTLE_BITS = np.zeros(256, dtype=np.uint8)
+for _right, _bit in CASTLE_BITS.items():
+    _CASTLE_BITS[ord(_right)] = _bit
+_DIGITS = np.full(256, -1, dtype=np.int64)
+_DIGITS[list(b"0123456789")] = np.arange(10)
+
+# Square index of the n-th square of a standard FEN board
+_RANK_8_FIRST = np.array([(7 - i // 8) * 8 + i % 8 for i in range(64)], dtype=np.int32)
+
+# Fields of a line
+BOARD, ON_MOVE, CASTLES, EN_PASSENT, FIFTY_MR, FULL_MOVE = range(6)
+
+# Bytes of a file decoded at once by load
+CHUNK_BYTES = 1 << 22
+
+
+class Positions:
+    """Positions decoded from FENs, one row per line.
+
+    ``squares`` are the piece codes as in Board.squares, the en passent
+    target included, ``castles`` are bits as in CASTLE_BITS and ``ep`` is
+    the index of the en passent square or -1.
+    """
+
+    def __init__(self, squares, on_move, castles, ep, fifty_mr, full_move):
+        self.squares = squares
+        self.on_move = on_move
+        self.castles = castles
+        self.ep = ep
+        self.fifty_mr = fifty_mr
+        self.full_move = full_move
+
+    def __len__(self):
+        return len(self.squares)
+
+    def fens(self, standard=True):
+        return fens(self.squares, self.on_move, self.castles, self.fifty_mr, self.full_move, standard)
+
+    def game(self, i):
+        """Position i as a chess.Game"""
+        part = slice(i, i + 1)
+        fen = fens(
+            self.squares[part], self.on_move[part], self.castles[part], self.fifty_mr[part], self.full_move[part]
+        )[0]
+        return chess.Game(fen)
+
+    @staticmethod
+    def empty():
+        return Positions(
+            np.zeros((0, 64), dtype=np.int8),
+            np.zeros(0, dtype=np.int8),
+            np.zeros(0, dtype=np.uint8),
+            np.zeros(0, dtype=np.int8),
+            np.zeros(0, dtype=np.int16),
+            np.zeros(0, dtype=np.int32),
+        )
+
+    @staticmethod
+    def concatenate(parts):
+        """The rows of all parts in one Positions"""
+        if not parts:
+            return Positions.empty()
+        if len(parts) == 1:
+            return parts[0]
+        return Positions(
+            *(
+                np.concatenate([getattr(part, name) for part in parts])
+                for name in ("squares", "on_move", "castles", "ep", "fifty_mr", "full_move")
+            )
+        )
+
+
+def load(path, chunk_bytes=CHUNK_BYTES):
+    """Decodes a file of FEN or EPD lines, chunk_bytes at a time"""
+    parts = []
+    line = 1
+    rest = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            # the last line of a chunk goes on with the next one
+            cut = chunk.rfind(b"\n") + 1
+            if not cut:
+                rest += chunk
+                continue
+            data = rest + chunk[:cut]
+            rest = chunk[cut:]
+            parts.append(decode(data, line))
+            line += data.count(b"\n")
+    if rest:
+        parts.append(decode(rest, line))
+    return Positions.concatenate(parts)
+
+
+@instrument.timed("fen.decode")
+def decode(data, first_line=1):
+    """Decodes a bytes buffer of FEN or EPD lines, blank lines are skipped.
+
+    Raises ValueError naming the first line whose board is not 64 squares,
+    counted from first_line for the first line of data.
+    """
+    buf = np.frombuffer(bytes(data) + b"\n", dtype=np.uint8)
+    newline = buf == ord("\n")
+    space = _WHITESPACE[buf]
+    if space.all():
+        return Positions.empty()
+    # tokens start on a non space byte after a space (newlines are spaces)
+    starts = ~space & np.concatenate(([True], space[:-1]))
+    token = np.cumsum(starts, dtype=np.int32)
+    start_positions = np.flatnonzero(starts)
+    # a line starts with the first token after a newline, blank lines have
+    # none so lines are numbered by the rows they end up in
+    newlines = np.cumsum(newline, dtype=np.int32)[start_positions]
+    first_of_line = np.concatenate(([True], newlines[1:] != newlines[:-1]))
+    line_starts = np.zeros(len(buf), dtype=bool)
+    line_starts[start_positions[first_of_line]] = True
+    first_token = token[start_positions[first_of_line]]
+    lines_used = newlines[first_of_line]
+    n = len(first_token)
+
+    pos = np.flatnonzero(~space)
+    row = np.cumsum(line_starts, dtype=np.int32)[pos] - 1
+    field = token[pos] - first_token[row]
+    chars = buf[pos]
+
+    # the first character of every field, 0 where the line is too short
+    heads = np.zeros((n, FULL_MOVE + 1), dtype=np.uint8)
+    head = starts[pos] & (field <= FULL_MOVE)
+    heads[row[head], field[head]] = chars[head]
+
+    on_move_char = heads[:, ON_MOVE]
+    standard = (on_move_char == ord("w")) | (on_move_char == ord("b"))
+    on_move = np.where((on_move_char == ord("b")) | (on_move_char == ord("-")), -1, 1).astype(np.int8)
+
+    # board, every character advances by its width
+    in_board = field == BOARD
+    board_chars = chars[in_board]
+    board_rows = row[in_board]
+    widths = _WIDTHS[board_chars]
+    bad = np.zeros(n, dtype=bool)
+    bad[board_rows[widths < 0]] = True
+    widths = np.maximum(widths, 0)
+    ends = np.cumsum(widths, dtype=np.int32)
+    totals = np.zeros(n, dtype=np.int32)
+    np.add.at(totals, board_rows, widths)
+    line_ends = np.cumsum(totals, dtype=np.int32)
+    offset = ends - widths - (line_ends - totals)[board_rows]
+    bad |= totals != 64
+    if bad.any():
+        number = int(lines_used[np.argmax(bad)]) + first_line
+        raise ValueError(f"line {number} does not hold a board of 64 squares")
+    placed = _IS_PIECE[board_chars]
+    offset = offset[placed]
+    rows = board_rows[placed]
+    # standard boards start with rank 8
+    index = np.where(standard[rows], _RANK_8_FIRST[offset], offset)
+    squares = np.zeros((n, 64), dtype=np.int8)
+    squares[rows, index] = _PIECE_CODES[board_chars[placed]]
+
+    in_castles = field == CASTLES
+    castles = np.zeros(n, dtype=np.uint8)
+    np.bitwise_or.at(castles, row[in_castles], _CASTLE_BITS[chars[in_castles]])
+
+    # en passent, a file letter and a rank digit
+    ep_file = heads[:, EN_PASSENT].astype(np.int64) - ord("a")
+    in_ep = (field == EN_PASSENT) & ~starts[pos]
+    ep_rank = np.zeros(n, dtype=np.int64)
+    ep_rank[row[in_ep]] = _DIGITS[chars[in_ep]] - 1
+    has_ep = (ep_file >= 0) & (ep_file < 8) & (ep_rank >= 0) & (ep_rank < 8)
+    ep = np.where(has_ep, ep_rank * 8 + ep_file, -1).astype(np.int8)
+    squares[has_ep, ep[has_ep]] = pieces.EN_PASSENT_TARGET
+
+    fifty_mr = _number(row, field, chars, pos, FIFTY_MR, n, 0).astype(np.int16)
+    full_move = _number(row, field, chars, pos, FULL_MOVE, n, 1).astype(np.int32)
+    # an EPD operation in the fifty move field leaves both counters out
+    full_move[(fifty_mr < 0) | (full_move < 0)] = 1
+    fifty_mr[fifty_mr < 0] = 0
+    instrument.count("fen.decoded", n)
+    return Positions(squares, on_move, castles, ep, fifty_mr, full_move)
+
+
+def _number(row, field, chars, pos, which, n, default):
+    """The decimal numbers in field which, default when a line does not have
+    it and -1 when it is not a number"""
+    inside = field == which
+    rows = row[inside]
+    digits = _DIGITS[chars[inside]]
+    numbers = np.full(n, default, dtype=np.int64)
+    if not len(rows):
+        return numbers
+    numbers[rows] = 0
+    # the place of every digit is its distance to the last one of the field
+    last = np.zeros(n, dtype=np.int64)
+    np.maximum.at(last, rows, pos[inside])
+    places = last[rows] - pos[inside]
+    np.add.at(numbers, rows, np.maximum(digits, 0) * 10 ** np.minimum(places, 18))
+    invalid = np.zeros(n, dtype=bool)
+    invalid[rows[digits < 0]] = True
+    numbers[invalid] = -1
+    return numbers
+
+
+def board_fen(mailbox, ep=None, standard=False):
+    """The board field of a FEN for 64 piece codes, in the format of Game.fen
+    or with standard=True ranks 8 to 1 without the en passent target"""
+    chars = [FEN_CHARS[code] for code in mailbox]
+    if ep is not None and not standard:
+        chars[ep] = "E"
+    elif standard:
+        chars = ["1" if char == "E" else char for char in chars]
+    ranks = ["".join(chars[i : i + 8]) for i in range(0, 64, 8)]
+    if standard:
+        fen = "/".join(reversed(ranks))
+    else:
+        fen = "/".join(ranks) + "/"
+    for run, count in EMPTY_RUNS:
+        fen = fen.replace(run, count)
+    return fen
+
+
+def castles_fen(bits):
+    return "".join(right for right, bit in CASTLE_BITS.items() if bits & bit) or "-"
+
+
+def fens(squares, on_move, castles, fifty_mr=None, full_move=None, standard=True):
+    """FENs of n positions given as arrays like those of Positions"""
+    squares = np.asarray(squares).reshape(-1, 64)
+    n = len(squares)
+    fifty_mr = np.zeros(n, dtype=np.int64) if fifty_mr is None else np.asarray(fifty_mr)
+    full_move = np.ones(n, dtype=np.int64) if full_move is None else np.asarray(full_move)
+    targets = np.argmax(squares == pieces.EN_PASSENT_TARGET, axis=1)
+    has_ep = squares[np.arange(n), targets] == pieces.EN_PASSENT_TARGET
+    out = []
+    for i, row in enumerate(squares.tolist()):
+        ep = int(targets[i]) if has_ep[i] else None
+        board = board_fen(row, None, standard)
+        side = ("w" if on_move[i] == 1 else "b") if standard else int(on_move[i])
+        ep_str = f"{chr(ord('a') + (ep & 7))}{(ep >> 3) + 1}" if ep is not None else "-"
+        out.append(f"{board} {side} {castles_fen(int(castles[i]))} {ep_str} {int(fifty_mr[i])} {int(full_move[i])}")
+    return out
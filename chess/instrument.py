@@ -0,0 +1,145 @@
+"""Counters and timers for the hot paths.
+
+Off unless the environment variable CHESS_INSTRUMENT is set when this module
+is first imported. Turned off, ``count`` is an empty function, ``timer`` hands
+out one shared empty context manager and ``timed`` returns the function it
+decorates as it is, so instrumented code runs as if it was not. Turned on,
+counters are summed in a dict and every timed call goes in a histogram of
+durations by powers of two, nothing is printed or written while running::
+
+    CHESS_INSTRUMENT=1 python ...                  # on, read with snapshot
+    CHESS_INSTRUMENT=stats-{pid}.json python ...   # on, dumped at exit
+
+Every process keeps its own numbers, {pid} in the path keeps them apart.
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+
+ENV_VAR = "CHESS_INSTRUMENT"
+_setting = os.environ.get(ENV_VAR, "")
+ENABLED = _setting not in ("", "0")
+
+# Durations up to 2 ** BUCKETS nanoseconds, about 18 minutes
+BUCKETS = 40
+
+counters = defaultdict(int)
+# name to [calls, total nanoseconds, histogram], bucket b of the histogram
+# counts the calls that took less than 2 ** b nanoseconds
+timers = {}
+
+
+def _timer_entry(name):
+    entry = timers.get(name)
+    if entry is None:
+        entry = timers[name] = [0, 0, [0] * (BUCKETS + 1)]
+    return entry
+
+
+def _record(name, ns):
+    entry = _timer_entry(name)
+    entry[0] += 1
+    entry[1] += ns
+    entry[2][min(ns.bit_length(), BUCKETS)] += 1
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, time.perf_counter_ns() - self.start)
+
+
+if ENABLED:
+
+    def count(name, n=1):
+        counters[name] += n
+
+    def timer(name):
+        """Context manager timing its block under name"""
+        return _Timer(name)
+
+    def timed(name):
+        """Decorator timing every call of a function under name"""
+
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter_ns()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    _record(name, time.perf_counter_ns() - start)
+
+            return wrapper
+
+        return decorate
+
+else:
+    _NULL_TIMER = contextlib.nullcontext()
+
+    def count(name, n=1):
+        pass
+
+    def timer(name):
+        return _NULL_TIMER
+
+    def timed(name):
+        return lambda function: function
+
+
+def _bucket_name(bucket):
+    """The upper bound of a histogram bucket, readable"""
+    ns = 1 << bucket
+    for unit, size in (("s", 10**9), ("ms", 10**6), ("us", 10**3)):
+        if ns >= size:
+            return f"<{ns / size:.3g}{unit}"
+    return f"<{ns}ns"
+
+
+def snapshot():
+    """The counters and timers as a dict of plain values"""
+    timings = {}
+    for name, (calls, total, histogram) in sorted(timers.items()):
+        timings[name] = {
+            "calls": calls,
+            "total_s": total / 1e9,
+            "mean_us": total / calls / 1e3 if calls else 0.0,
+            "histogram": {_bucket_name(b): n for b, n in enumerate(histogram) if n},
+        }
+    return {
+        "enabled": ENABLED,
+        "pid": os.getpid(),
+        "counters": dict(sorted(counters.items())),
+        "timers": timings,
+    }
+
+
+def dump(path=None):
+    """The snapshot as JSON, also written to path when given"""
+    text = json.dumps(snapshot(), indent=2)
+    if path is not None:
+        with open(path.format(pid=os.getpid()), "w") as f:
+            f.write(text)
+    return text
+
+
+def reset():
+    counters.clear()
+    timers.clear()
+
+
+if ENABLED and _setting != "1":
+    atexit.register(dump, _setting)
@@ -0,0 +1,239 @@
+"""Legal move generation.
+
+Everything that decides legality is worked out once per position: the pieces
+giving check, the pieces pinned to their king and the squares the opponent
+attacks. Every move that comes out is legal, no move is tried on a board to
+see if it leaves the king in check.
+"""
+
+import chess
+from chess import attacks, bitboard, instrument, pieces
+
+# Promotion piece types in the order they are generated
+PROMOTIONS = (pieces.QUEEN, pieces.ROOK, pieces.BISHOP, pieces.KNIGHT)
+
+# (right, king start, king end, squares that must be empty, squares the king
+# passes that may not be attacked)
+CASTLES = {
+    1: (
+        ("K", 4, 6, 0x60, 0x60),
+        ("Q", 4, 2, 0x0E, 0x0C),
+    ),
+    -1: (
+        ("k", 60, 62, 0x60 << 56, 0x60 << 56),
+        ("q", 60, 58, 0x0E << 56, 0x0C << 56),
+    ),
+}
+
+
+def pins(board, king: int, col: int):
+    """Maps every pinned piece of col to the squares it can still move to"""
+    them = -col
+    bbs = board.bitboards
+    snipers = (attacks.ROOK_RAYS[king] & (bbs[pieces.ROOK * them] | bbs[pieces.QUEEN * them])) | (
+        attacks.BISHOP_RAYS[king] & (bbs[pieces.BISHOP * them] | bbs[pieces.QUEEN * them])
+    )
+    pinned = {}
+    own = board.occupied_co[col]
+    for sniper in bitboard.scan(snipers):
+        between = attacks.BETWEEN[king][sniper] & board.occupied
+        if between and not between & (between - 1) and between & own:
+            pinned[between.bit_length() - 1] = attacks.BETWEEN[king][sniper] | bitboard.BB_SQUARES[sniper]
+    return pinned
+
+
+def _moves_to(start: int, targets: int, out: list):
+    for end in bitboard.scan(targets):
+        out.append(start | (end << 6))
+
+
+def _pawn_moves_to(start: int, targets: int, out: list):
+    for end in bitboard.scan(targets):
+        code = start | (end << 6)
+        if end >= 56 or end < 8:
+            for prom in PROMOTIONS:
+                out.append(code | (prom << 12))
+        else:
+            out.append(code)
+
+
+def legal_moves(game, from_mask: int = bitboard.FULL):
+    """All legal moves for the side on move, starting on a square in from_mask"""
+    decode = chess.Move.decode
+    return [decode(code) for code in legal_codes(game, from_mask)]
+
+
+@instrument.timed("movegen.legal_codes")
+def legal_codes(game, from_mask: int = bitboard.FULL):
+    """Like legal_moves, but gives the moves as codes (see chess.encode_move)"""
+    moves = []
+    checks = _checks(game)
+    if checks is not None:
+        _generate(game, checks, from_mask, bitboard.FULL, True, True, False, moves)
+    return moves
+
+
+def has_legal_move(game):
+    """Whether the side on move can move at all. Stops at the first piece
+    with a legal move, the king is tried first."""
+    moves = []
+    checks = _checks(game)
+    if checks is not None:
+        _generate(game, checks, bitboard.FULL, bitboard.FULL, True, True, True, moves)
+    return bool(moves)
+
+
+def staged_codes(game, hash_move=None, quiets=True):
+    """Yields the legal move codes in stages: hash_move if it is legal, the
+    captures by most valuable victim and then least valuable attacker, the
+    promotions and last the quiet moves.
+
+    A stage is only generated once the one before it is used up, a caller
+    that stops early, like a search at a cut off, never pays for the rest.
+    quiets=False leaves out the last stage, for a quiescence search. The
+    position must be the same whenever the next move is taken.
+    """
+    checks = _checks(game)
+    if checks is None:
+        return
+    board = game.board
+    col = game.on_move
+    if hash_move is not None:
+        moves = []
+        bbs = bitboard.BB_SQUARES
+        _generate(game, checks, bbs[hash_move & 63], bbs[hash_move >> 6 & 63], True, True, False, moves)
+        if hash_move in moves:
+            yield hash_move
+        else:
+            hash_move = None
+
+    captures = []
+    _generate(game, checks, bitboard.FULL, board.occupied_co[-col], False, True, False, captures)
+    mailbox = board.mailbox
+    # piece types run from king (1) to pawn (6), en passent takes a pawn
+    captures.sort(key=lambda code: (abs(mailbox[code >> 6 & 63]) or pieces.PAWN) * 8 - abs(mailbox[code & 63]))
+    for code in captures:
+        if code != hash_move:
+            yield code
+
+    empty = ~board.occupied & bitboard.FULL
+    promoting = board.bitboards[pieces.PAWN * col] & (bitboard.RANK_7 if col == 1 else bitboard.RANK_2)
+    if promoting:
+        promotions = []
+        _generate(game, checks, promoting, empty, False, False, False, promotions)
+        for code in promotions:
+            if code != hash_move:
+                yield code
+
+    if quiets:
+        rest = []
+        _generate(game, checks, bitboard.FULL ^ promoting, empty, True, False, False, rest)
+        for code in rest:
+            if code != hash_move:
+                yield code
+
+
+def _checks(game):
+    """What legality depends on: (king, attacked squares, checkers, the
+    squares that stop a check, pinned pieces), None without a king"""
+    # every way of generating moves starts here, once per position
+    instrument.count("movegen.positions")
+    board = game.board
+    col = game.on_move
+    king = board.kings[col]
+    if king is None:
+        return None
+    occupied = board.occupied
+    # the king is taken off the board so it can not step back along a checking ray
+    attacked = board.attacks_by(-col, occupied ^ bitboard.BB_SQUARES[king])
+    checkers = board.attackers_to(king, -col, occupied)
+    if not checkers:
+        target = bitboard.FULL
+    elif checkers & (checkers - 1):
+        # double check, only the king can move
+        target = 0
+    else:
+        target = attacks.BETWEEN[king][checkers.bit_length() - 1] | checkers
+    return king, attacked, checkers, target, pins(board, king, col)
+
+
+@instrument.timed("movegen.generate")
+def _generate(game, checks, from_mask: int, to_mask: int, castles: bool, en_passent: bool, first_only: bool, moves):
+    """Appends the legal moves from a square in from_mask to one in to_mask.
+    Castling and taking en passent are only included when asked for, and
+    then whatever to_mask is. With first_only it stops after the first piece
+    that has any moves."""
+    board = game.board
+    col = game.on_move
+    bbs = board.bitboards
+    occupied = board.occupied
+    own = board.occupied_co[col]
+    enemy = board.occupied_co[-col]
+    king, attacked, checkers, target, pinned = checks
+
+    king_bb = bitboard.BB_SQUARES[king]
+    if king_bb & from_mask:
+        _moves_to(king, attacks.KING_ATTACKS[king] & ~own & ~attacked & to_mask, moves)
+        if castles and not checkers:
+            _castles(game, col, attacked, moves)
+        if first_only and moves:
+            return
+    if not target:
+        return
+    target &= to_mask
+
+    for piece_type, attack in (
+        (pieces.KNIGHT, lambda i: attacks.KNIGHT_ATTACKS[i]),
+        (pieces.BISHOP, lambda i: attacks.bishop_attacks(i, occupied)),
+        (pieces.ROOK, lambda i: attacks.rook_attacks(i, occupied)),
+        (pieces.QUEEN, lambda i: attacks.queen_attacks(i, occupied)),
+    ):
+        for start in bitboard.scan(bbs[piece_type * col] & from_mask):
+            targets = attack(start) & ~own & target
+            if start in pinned:
+                targets &= pinned[start]
+            _moves_to(start, targets, moves)
+            if first_only and moves:
+                return
+
+    empty = ~occupied & bitboard.FULL
+    ep = board.ep if en_passent else None
+    for start in bitboard.scan(bbs[pieces.PAWN * col] & from_mask):
+        if col == 1:
+            single = (1 << (start + 8)) & empty
+            double = (single << 8) & empty & bitboard.RANK_4
+        else:
+            single = (1 << (start - 8)) & empty if start >= 8 else 0
+            double = (single >> 8) & empty & bitboard.RANK_5
+        pawn_attacks = attacks.PAWN_ATTACKS[col][start]
+        targets = ((single | double) | (pawn_attacks & enemy)) & target
+        if start in pinned:
+            targets &= pinned[start]
+        _pawn_moves_to(start, targets, moves)
+        if ep is not None and pawn_attacks & bitboard.BB_SQUARES[ep]:
+            if _en_passent_is_legal(board, start, ep, king, col):
+                moves.append(start | (ep << 6))
+        if first_only and moves:
+            return
+
+
+def _en_passent_is_legal(board, start: int, ep: int, king: int, col: int):
+    # Taking en passent empties two squares on the same rank, play it out on
+    # the occupancy and look for attacks on the king.
+    taken = bitboard.BB_SQUARES[ep - 8 * col]
+    occupied = (board.occupied ^ bitboard.BB_SQUARES[start] ^ taken) | bitboard.BB_SQUARES[ep]
+    return not board.attackers_to(king, -col, occupied) & ~taken
+
+
+def _castles(game, col: int, attacked: int, moves: list):
+    board = game.board
+    rooks = board.bitboards[pieces.ROOK * col]
+    for right, king, end, empty, safe in CASTLES[col]:
+        if not game.castles[right] or not board.bitboards[pieces.KING * col] & bitboard.BB_SQUARES[king]:
+            continue
+        rook = end + 1 if end > king else end - 2
+        if not rooks & bitboard.BB_SQUARES[rook]:
+            continue
+        if board.occupied & empty or attacked & safe:
+            continue
+        moves.append(king | (end << 6))
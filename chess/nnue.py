@@ -0,0 +1,105 @@
+"""Efficiently updatable network input.
+
+The input is a piece-square one-hot encoding, one feature for every piece
+type and colour on every square, 12 * 64 of them. At most 32 are set, and
+a move changes two to four, so the first dense layer is not worked out from
+the whole input. An Accumulator holds its output for one board and adds or
+subtracts the weight row of each feature as pieces are put on or taken off.
+
+The weights are rounded to fixed point integers for this, adding and
+subtracting them is then exact, so a position reached by pushing and popping
+moves has the very same accumulator as one built from scratch.
+"""
+
+import numpy as np
+
+from chess import pieces
+
+FEATURES = 12 * 64
+# 1 / SCALE is the precision of the rounded weights
+SCALE = 1 << 16
+
+# Feature block of a piece code, white pieces 0 to 5, black pieces 6 to 11.
+# Indexed by code + 6, empty squares and the en passent target have none.
+PIECE_BLOCKS = np.full(14, -1, dtype=np.int64)
+for _code in range(1, 7):
+    PIECE_BLOCKS[_code + 6] = _code - 1
+    PIECE_BLOCKS[-_code + 6] = _code + 5
+# The first feature of each piece code, indexed like Board.bitboards
+FEATURE_OFFSETS = [0] * 13
+for _code in range(-6, 7):
+    if _code:
+        FEATURE_OFFSETS[_code] = int(PIECE_BLOCKS[_code + 6]) * 64
+
+
+def feature(piece: int, index: int):
+    """The input feature of piece on the square index"""
+    return FEATURE_OFFSETS[piece] + index
+
+
+def encode(squares, dtype=np.float32):
+    """(n, 64) piece codes as in Board.squares to (n, FEATURES) one-hot rows"""
+    squares = np.asarray(squares).reshape(-1, 64).astype(np.int64)
+    blocks = PIECE_BLOCKS[squares + 6]
+    rows, columns = np.nonzero(blocks >= 0)
+    features = np.zeros((len(squares), FEATURES), dtype=dtype)
+    features[rows, blocks[rows, columns] * 64 + columns] = 1
+    return features
+
+
+class FeatureTransformer:
+    """The first dense layer in fixed point, shared by all its accumulators"""
+
+    def __init__(self, weights, bias):
+        """weights is the (FEATURES, n) kernel of the layer, bias its n biases"""
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape[0] != FEATURES:
+            raise ValueError(f"the first layer takes {weights.shape[0]} inputs, not {FEATURES}")
+        self.weights = np.round(weights * SCALE).astype(np.int64)
+        self.bias = np.round(np.asarray(bias, dtype=np.float64) * SCALE).astype(np.int64)
+
+    def accumulator(self, board):
+        """A new accumulator for board, worked out from scratch"""
+        accumulator = Accumulator(self, self.bias.copy())
+        accumulator.refresh(board)
+        return accumulator
+
+
+class Accumulator:
+    """The first layer output for one board.
+
+    Set as ``Board.accumulator`` it is kept up to date by ``put_piece`` and
+    ``remove_piece``, so by every move pushed or popped on a Game.
+    """
+
+    __slots__ = ("transformer", "_values")
+
+    def __init__(self, transformer, values):
+        self.transformer = transformer
+        self._values = values
+
+    def refresh(self, board):
+        features = [
+            FEATURE_OFFSETS[piece] + index
+            for index, piece in enumerate(board.mailbox)
+            if piece != pieces.EMPTY_SQUARE
+        ]
+        weights = self.transformer.weights
+        self._values = self.transformer.bias + weights[features].sum(axis=0, dtype=weights.dtype)
+
+    def clear(self):
+        self._values = self.transformer.bias.copy()
+
+    def add(self, piece: int, index: int):
+        self._values += self.transformer.weights[FEATURE_OFFSETS[piece] + index]
+
+    def sub(self, piece: int, index: int):
+        self._values -= self.transformer.weights[FEATURE_OFFSETS[piece] + index]
+
+    def copy(self):
+        return Accumulator(self.transformer, self._values.copy())
+
+    @property
+    def values(self):
+        """The layer output before its activation, as floats"""
+        return self._values / SCALE
@@ -0,0 +1,131 @@
+"""Perft, counts the leaf nodes of the move tree to a fixed depth.
+
+Checks move generation against known node counts and measures its speed::
+
+    python -m chess.perft                      # all reference positions
+    python -m chess.perft --depth 3 --divide   # start position, per move
+    python -m chess.perft --fen "<fen>" --depth 4
+"""
+
+import argparse
+import sys
+import time
+
+import chess
+from chess import movegen
+
+# (name, standard FEN, node counts for depth 1, 2, ...)
+POSITIONS = [
+    (
+        "start",
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609],
+    ),
+    (
+        "kiwipete",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603],
+    ),
+    (
+        "position 3",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624],
+    ),
+    (
+        "position 4",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333],
+    ),
+    (
+        "position 5",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487],
+    ),
+    (
+        "position 6",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594],
+    ),
+]
+
+
+def perft(game, depth: int):
+    """Number of leaf nodes depth plies below game, which is left unchanged"""
+    codes = movegen.legal_codes(game)
+    if depth <= 1:
+        return len(codes) if depth == 1 else 1
+    decode = chess.Move.decode
+    nodes = 0
+    for code in codes:
+        game.push(decode(code))
+        nodes += perft(game, depth - 1)
+        game.pop()
+    return nodes
+
+
+def divide(game, depth: int):
+    """Maps every legal move to the perft of depth - 1 after it"""
+    counts = {}
+    for move in movegen.legal_moves(game):
+        game.push(move)
+        counts[str(move)] = perft(game, depth - 1)
+        game.pop()
+    return counts
+
+
+def run(game, depth: int, show_divide=False, out=sys.stdout):
+    """Runs perft on game and prints the result, returns (nodes, seconds)"""
+    start = time.perf_counter()
+    if show_divide:
+        counts = divide(game, depth)
+        for move in sorted(counts):
+            print(f"{move}: {counts[move]}", file=out)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(game, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+
+def format_result(depth, nodes, elapsed):
+    nps = nodes / elapsed if elapsed > 0 else 0
+    return f"depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nps:.0f} nodes/s)"
+
+
+def run_suite(max_depth: int, out=sys.stdout):
+    """Runs every reference position up to max_depth, returns False on a mismatch"""
+    ok = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected in POSITIONS:
+        print(f"{name}: {fen}", file=out)
+        for depth, want in enumerate(expected[:max_depth], 1):
+            nodes, elapsed = run(chess.Game(fen), depth)
+            total_nodes += nodes
+            total_time += elapsed
+            status = "ok" if nodes == want else f"FAILED, expected {want}"
+            ok = ok and nodes == want
+            print(f"  {format_result(depth, nodes, elapsed)} {status}", file=out)
+    print(f"total: {format_result(max_depth, total_nodes, total_time)}", file=out)
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m chess.perft", description=__doc__.splitlines()[0])
+    parser.add_argument("--fen", help="position to run, the reference positions when left out")
+    parser.add_argument("--depth", type=int, default=None, help="plies to search")
+    parser.add_argument("--divide", action="store_true", help="print the node count after every root move")
+    args = parser.parse_args(argv)
+
+    if args.fen is None and not args.divide:
+        return 0 if run_suite(args.depth or 3) else 1
+
+    game = chess.Game(args.fen or POSITIONS[0][1])
+    depth = args.depth or 3
+    nodes, elapsed = run(game, depth, show_divide=args.divide)
+    print(format_result(depth, nodes, elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
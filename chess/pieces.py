@@ -1,14 +1,30 @@
+import chess
+from chess import attacks, bitboard
+
 EMPTY_SQUARE = 0
+EN_PASSENT_TARGET = 7
+# Piece types, the code of a piece is its type times its colour
+KING = 1
+QUEEN = 2
+ROOK = 3
+BISHOP = 4
+KNIGHT = 5
+PAWN = 6
 WHITE_PIECES = frozenset([1, 2, 3, 4, 5, 6])
 BLACK_PIECES = frozenset([-1, -2, -3, -4, -5, -6])
 WHITE_PROMOTIONS = WHITE_PIECES - {6}
 BLACK_PROMOTIONS = BLACK_PIECES - {-6}
 
 
+def squares_of(bb: int):
+    """The set of Squares in a bitboard"""
+    return {chess.Square.from_index(i) for i in bitboard.scan(bb)}
+
+
 def colour_of_piece(piece):
-    if piece in WHITE_PIECES:
+    if 0 < piece < 7:
         return 1
-    if piece in BLACK_PIECES:
+    if -7 < piece < 0:
         return -1
 
 
@@ -18,57 +34,27 @@ class Piece:
     def __init__(self):
         pass
 
-    def move_squares(self, board, start):
+    def attacks(self, board, index: int):
+        """Bitboard of the squares attacked from index, own pieces included"""
         raise NotImplementedError()
 
+    def move_squares(self, board, start):
+        return squares_of(self.attacks(board, start.to_index()) & ~board.occupied_co[self.colour])
+
     def threat_squares(self, board, start):
-        raise NotImplementedError()
+        return self.move_squares(board, start)
 
     # def poss_squares(self, board, start):
     #     return self.move_squares(board, start).union(self.threat_squares(board, start))
 
-    def generate_end_squares(
-        self,
-        board,
-        start,
-        delta_x: int,
-        delta_y: int,
-        max_moves=7,
-        can_take=True,
-    ):
-        ends = []
-        pos = start
-        for _ in range(max_moves):
-            if not (0 < pos.rank + delta_y < 9) or not (0 < pos.file + delta_x < 9):
-                break
-            pos = pos.delta(delta_x, delta_y)
-            if not pos:
-                break
-
-            piece_at_pos = board.piece_at(pos)
-            if piece_at_pos == 0:
-                ends.append(pos)
-            else:
-                if can_take and colour_of_piece(piece_at_pos) != self.colour:
-                    ends.append(pos)
-                break
-        return ends
-
     @property
     def colour(self):
         return colour_of_piece(PIECES_FENS[self.fen])
 
 
 class Knight(Piece):
-    def move_squares(self, board, start):
-        ends = set()
-        for x in (1, -1):
-            for y in (2, -2):
-                ends.update(self.generate_end_squares(board, start, x, y, max_moves=1))
-        return ends
-
-    def threat_squares(self, board, start):
-        return self.move_squares(board, start)
+    def attacks(self, board, index: int):
+        return attacks.KNIGHT_ATTACKS[index]
 
 
 class WhiteKnight(Knight):
@@ -80,15 +66,8 @@ class BlackKnight(Knight):
 
 
 class Bishop(Piece):
-    def move_squares(self, board, start):
-        ends = set()
-        for x in (1, -1):
-            for y in (1, -1):
-                ends.update(self.generate_end_squares(board, start, x, y))
-        return ends
-
-    def threat_squares(self, board, start):
-        return self.move_squares(board, start)
+    def attacks(self, board, index: int):
+        return attacks.bishop_attacks(index, board.occupied)
 
 
 class WhiteBishop(Bishop):
@@ -100,15 +79,8 @@ class BlackBishop(Bishop):
 
 
 class Rook(Piece):
-    def move_squares(self, board, start):
-        ends = set()
-        for x in (1, -1):
-            ends.update(self.generate_end_squares(board, start, x, 0))
-            ends.update(self.generate_end_squares(board, start, 0, x))
-        return ends
-
-    def threat_squares(self, board, start):
-        return self.move_squares(board, start)
+    def attacks(self, board, index: int):
+        return attacks.rook_attacks(index, board.occupied)
 
 
 class WhiteRook(Rook):
@@ -120,17 +92,8 @@ class BlackRook(Rook):
 
 
 class Queen(Piece):
-    def move_squares(self, board, start):
-        ends = set()
-        for x in (1, -1):
-            for y in (1, -1):
-                ends.update(self.generate_end_squares(board, start, x, y))
-            ends.update(self.generate_end_squares(board, start, x, 0))
-            ends.update(self.generate_end_squares(board, start, 0, x))
-        return ends
-
-    def threat_squares(self, board, start):
-        return self.move_squares(board, start)
+    def attacks(self, board, index: int):
+        return attacks.queen_attacks(index, board.occupied)
 
 
 class WhiteQueen(Queen):
@@ -142,17 +105,8 @@ class BlackQueen(Queen):
 
 
 class King(Piece):
-    def move_squares(self, board, start):
-        ends = set()
-        for x in (1, -1):
-            for y in (1, -1):
-                ends.update(self.generate_end_squares(board, start, x, y, max_moves=1))
-            ends.update(self.generate_end_squares(board, start, x, 0, max_moves=1))
-            ends.update(self.generate_end_squares(board, start, 0, x, max_moves=1))
-        return ends
-
-    def threat_squares(self, board, start):
-        return self.move_squares(board, start)
+    def attacks(self, board, index: int):
+        return attacks.KING_ATTACKS[index]
 
 
 class WhiteKing(King):
@@ -164,36 +118,25 @@ class BlackKing(King):
 
 
 class Pawn(Piece):
-    def move_squares(self, board, start):
-        start_square = False
+    def attacks(self, board, index: int):
+        return attacks.PAWN_ATTACKS[self.colour][index]
+
+    def pushes(self, board, index: int):
+        """Bitboard of the empty squares the pawn can walk to"""
+        empty = ~board.occupied
         if self.fen == "P":
-            dy = 1
-            if start.rank == 2:
-                start_square = True
+            single = (1 << index << 8) & empty & bitboard.FULL
+            double = (single << 8) & empty & bitboard.RANK_4
         else:
-            dy = -1
-            if start.rank == 7:
-                start_square = True
-        if start_square:
-            max_m = 2
-        else:
-            max_m = 1
-        ends = set(
-            self.generate_end_squares(
-                board, start, 0, dy, max_moves=max_m, can_take=False
-            )
-        )
-        return ends
+            single = (1 << index >> 8) & empty
+            double = (single >> 8) & empty & bitboard.RANK_5
+        return single | double
+
+    def move_squares(self, board, start):
+        return squares_of(self.pushes(board, start.to_index()))
 
     def threat_squares(self, board, start):
-        ends = set()
-        if self.fen == "P":
-            dy = 1
-        else:
-            dy = -1
-        ends.update(self.generate_end_squares(board, start, 1, dy, max_moves=1))
-        ends.update(self.generate_end_squares(board, start, -1, dy, max_moves=1))
-        return ends
+        return squares_of(self.attacks(board, start.to_index()) & ~board.occupied_co[self.colour])
 
 
 class WhitePawn(Pawn):
@@ -207,13 +150,14 @@ class BlackPawn(Pawn):
 class EnPassentTarget(Piece):
     fen = "E"
 
+    def attacks(self, board, index: int):
+        return 0
+
     def move_squares(self, board, start):
-        ends = set()
-        return ends
+        return set()
 
     def threat_squares(self, board, start):
-        ends = set()
-        return ends
+        return set()
 
 
 # TODO this is horrible.
@@ -0,0 +1,324 @@
+"""Alpha-beta search.
+
+Negamax with alpha-beta pruning and a quiescence search over captures,
+driven by iterative deepening so there is always a best move from the last
+finished depth when a node or time limit runs out. Positions are stored in a
+fixed size transposition table indexed by ``Game.key``.
+
+The evaluator is any callable taking a Game and returning a score from
+white's point of view, in centipawns: ``material`` or the ``agent_evaluator``
+of an EvalAgent. ``nnue_evaluator`` does the same for an agent with piece
+inputs, but keeps the first layer of the network up to date as the search
+pushes and pops moves instead of working it out for every position.
+"""
+
+import time
+
+import chess
+from chess import instrument, movegen, nnue, pieces
+
+MATE = 100000
+INF = 10 * MATE
+
+# Limits and stop are checked whenever the node count is a multiple of 256,
+# every few milliseconds
+CHECK_MASK = 255
+
+# Transposition table bounds
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+PIECE_VALUES = {
+    pieces.KING: 0,
+    pieces.QUEEN: 900,
+    pieces.ROOK: 500,
+    pieces.BISHOP: 330,
+    pieces.KNIGHT: 320,
+    pieces.PAWN: 100,
+}
+
+
+def material(game):
+    """Material balance from white's point of view"""
+    bbs = game.board.bitboards
+    score = 0
+    for piece_type, value in PIECE_VALUES.items():
+        score += value * (bbs[piece_type].bit_count() - bbs[-piece_type].bit_count())
+    return score
+
+
+def agent_evaluator(agent, scale=1000):
+    """Evaluator for an EvalAgent, its 0 to 1 output is mapped onto -scale to scale"""
+
+    def evaluate(game):
+        return (float(agent.eval([game.board.squares])[0][0]) - 0.5) * 2 * scale
+
+    return evaluate
+
+
+def nnue_evaluator(agent, scale=1000):
+    """Like agent_evaluator for an EvalAgent with inputs="pieces".
+
+    The first evaluation of a game sets an nnue.Accumulator on its board,
+    after that a position costs the few weight rows its move changed plus
+    the small layers behind the first. The weights are taken from the agent
+    once, make a new evaluator after training it.
+    """
+    if agent.inputs != "pieces":
+        raise ValueError("nnue_evaluator needs an agent with inputs=\"pieces\"")
+    if agent.np_model is None:
+        agent.sync_numpy()
+    model = agent.np_model
+    weights, bias, _ = model.layers[0]
+    transformer = nnue.FeatureTransformer(weights, bias)
+
+    def evaluate(game):
+        board = game.board
+        if board.accumulator is None or board.accumulator.transformer is not transformer:
+            board.accumulator = transformer.accumulator(board)
+        return (float(model.predict_from_first_layer(board.accumulator.values)[0][0]) - 0.5) * 2 * scale
+
+    return evaluate
+
+
+class TranspositionTable:
+    """Fixed size table of search results, indexed by the low bits of the key.
+
+    Entries are (key, depth, bound, score, move code). A new result replaces
+    the old one in its slot unless that one is for the same position and
+    searched deeper.
+    """
+
+    def __init__(self, size=1 << 20):
+        # round down to a power of two so the index is a mask
+        self.size = 1 << (size.bit_length() - 1)
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+
+    def get(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def put(self, key, depth, bound, score, move):
+        index = key & self.mask
+        old = self.entries[index]
+        if old is not None and old[0] == key and old[1] > depth:
+            return
+        self.entries[index] = (key, depth, bound, score, move)
+
+    def clear(self):
+        self.entries = [None] * self.size
+
+
+class SearchResult:
+    def __init__(self, move, score, depth, nodes, elapsed, pv):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.pv = pv
+
+    def __str__(self):
+        pv = " ".join(str(move) for move in self.pv)
+        return f"depth {self.depth} score {self.score:.0f} nodes {self.nodes} time {self.elapsed:.2f}s pv {pv}"
+
+
+class _Stop(Exception):
+    """Raised inside the search when a limit runs out"""
+
+    pass
+
+
+class Searcher:
+    def __init__(self, evaluate=material, tt_size=1 << 20):
+        self.evaluate = evaluate
+        self.tt = TranspositionTable(tt_size)
+        self.nodes = 0
+        self.stopped = False
+        self._node_limit = None
+        self._deadline = None
+        self._root_moves = None
+        self._root_best = None
+
+    def stop(self):
+        """Ends a running search, it returns the best move found so far"""
+        self.stopped = True
+
+    @instrument.timed("search")
+    def search(self, game, depth=None, nodes=None, movetime=None, on_info=None, root_moves=None):
+        """Finds the best move for the side on move in game.
+
+        Searches one ply deeper at a time until depth is reached, more than
+        nodes positions were visited or movetime seconds have passed. With no
+        limit at all it runs until stop is called. on_info is called with the
+        SearchResult of every finished depth. root_moves are the legal move
+        codes the best move is picked from, all of them without. game is left
+        as it was.
+        """
+        start = time.perf_counter()
+        self.nodes = 0
+        self.stopped = False
+        self._node_limit = nodes
+        self._deadline = start + movetime if movetime is not None else None
+        self._root_moves = set(root_moves) if root_moves else None
+        max_depth = depth or 100
+        root_stack = len(game.undo_stack)
+
+        result = None
+        for d in range(1, max_depth + 1):
+            try:
+                score = self._negamax(game, d, -INF, INF, 0)
+            except _Stop:
+                while len(game.undo_stack) > root_stack:
+                    game.pop()
+                break
+            pv = self._pv(game, d)
+            if pv[:1] != [self._root_best]:
+                # the table kept a deeper entry for the root, from a search
+                # over other root moves
+                pv = [self._root_best] if self._root_best is not None else []
+            result = SearchResult(pv[0] if pv else None, score, d, self.nodes, time.perf_counter() - start, pv)
+            if on_info:
+                on_info(result)
+            if abs(score) >= MATE - d:
+                # a forced mate was found, deeper searches can not improve it
+                break
+        if result is None:
+            # stopped before the first depth was done, play any legal move
+            moves = [chess.Move.decode(code) for code in root_moves or game.legal_codes()]
+            result = SearchResult(moves[0] if moves else None, 0, 0, self.nodes, time.perf_counter() - start, moves[:1])
+        instrument.count("search.nodes", self.nodes)
+        return result
+
+    def _check_limits(self):
+        if self.stopped:
+            raise _Stop()
+        if self._node_limit is not None and self.nodes >= self._node_limit:
+            raise _Stop()
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            raise _Stop()
+
+    def _score(self, game):
+        return self.evaluate(game) * game.on_move
+
+    def _negamax(self, game, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & CHECK_MASK == 0:
+            self._check_limits()
+
+        if ply > 0 and (game.repetition_count() > 1 or game.is_fifty_moves() or game.is_insufficient_material()):
+            # a position seen before on the way here can be repeated until
+            # it is a draw, so it counts as one already
+            return 0
+
+        key = game.key
+        alpha_start = alpha
+        tt_move = None
+        entry = self.tt.get(key)
+        if entry is not None:
+            tt_move = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                bound, score = entry[2], from_tt(entry[3], ply)
+                if bound == EXACT:
+                    return score
+                if bound == LOWER and score >= beta:
+                    return score
+                if bound == UPPER and score <= alpha:
+                    return score
+
+        if depth <= 0:
+            if not game.has_legal_moves():
+                return -MATE + ply if game.in_check else 0
+            return self._quiesce(game, alpha, beta, ply)
+
+        decode = chess.Move.decode
+        best_score = -INF
+        best_move = None
+        # the moves come in stages, the quiet ones are only generated when
+        # the hash move and the captures did not cut off
+        for code in movegen.staged_codes(game, tt_move):
+            if ply == 0 and self._root_moves is not None and code not in self._root_moves:
+                continue
+            game.push(decode(code))
+            score = -self._negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            game.pop()
+            if score > best_score:
+                best_score = score
+                best_move = code
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        if ply == 0:
+            self._root_best = decode(best_move) if best_move is not None else None
+        if best_move is None:
+            return -MATE + ply if game.in_check else 0
+
+        if best_score >= beta:
+            bound = LOWER
+        elif best_score <= alpha_start:
+            bound = UPPER
+        else:
+            bound = EXACT
+        self.tt.put(key, depth, bound, to_tt(best_score, ply), best_move)
+        return best_score
+
+    def _quiesce(self, game, alpha, beta, ply):
+        stand_pat = self._score(game)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        decode = chess.Move.decode
+        for code in movegen.staged_codes(game, None, quiets=False):
+            self.nodes += 1
+            if self.nodes & CHECK_MASK == 0:
+                self._check_limits()
+            game.push(decode(code))
+            score = -self._quiesce(game, -beta, -alpha, ply + 1)
+            game.pop()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def _pv(self, game, depth):
+        """Follows the best moves in the transposition table"""
+        pv = []
+        seen = set()
+        for _ in range(depth):
+            entry = self.tt.get(game.key)
+            if entry is None or entry[4] is None or game.key in seen:
+                break
+            move = chess.Move.decode(entry[4])
+            if entry[4] not in game.legal_codes():
+                break
+            seen.add(game.key)
+            pv.append(move)
+            game.push(move)
+        for _ in pv:
+            game.pop()
+        return pv
+
+
+def to_tt(score, ply):
+    """Mate scores are stored as distance from the position, not from the root"""
+    if score >= MATE - 1000:
+        return score + ply
+    if score <= -MATE + 1000:
+        return score - ply
+    return score
+
+
+def from_tt(score, ply):
+    if score >= MATE - 1000:
+        return score - ply
+    if score <= -MATE + 1000:
+        return score + ply
+    return score
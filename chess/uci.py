@@ -0,0 +1,287 @@
+"""UCI front end, so the engine can play in chess GUIs and match runners.
+
+    python -m chess.uci                                    # material count
+    python -m chess.uci --weights eval.npz                 # an EvalAgent
+    python -m chess.uci --weights eval.npz --inputs pieces # ... with nnue
+
+Commands are read on the main thread while a search runs on its own, so
+isready and stop are answered straight away, a search notices stop within a
+few hundred nodes. A command that changes the position or starts a search
+while one runs stops it first, the command thread never waits on a search
+that is not ending. go takes depth, nodes, movetime, infinite, searchmoves
+and the clock (wtime, btime, winc, binc, movestogo), see time_budget for how
+a clock is turned into a time for the move. Anything else, ponder included,
+is skipped. A go without the clock of the side on move
+and without any other limit is given DEFAULT_CLOCK, only go infinite runs
+until stop.
+"""
+
+import argparse
+import sys
+import threading
+
+import chess
+from chess import search
+
+ENGINE_NAME = "chess"
+ENGINE_AUTHOR = "the chess authors"
+
+# Seconds kept back on every move for the GUI and the pipes
+MOVE_OVERHEAD = 0.05
+# Moves the remaining clock is shared over when the GUI does not say
+DEFAULT_MOVES_TO_GO = 30
+# Seconds on the clock assumed when go gives no limit for the side on move
+DEFAULT_CLOCK = 60.0
+# Rough memory of one transposition table entry, for the Hash option
+TT_ENTRY_BYTES = 120
+DEFAULT_HASH_MB = 16
+
+# go limits followed by a number
+GO_NUMBERS = ("wtime", "btime", "winc", "binc", "movestogo", "depth", "nodes", "movetime")
+# Words of go that end the moves after searchmoves
+GO_KEYWORDS = GO_NUMBERS + ("searchmoves", "ponder", "infinite", "mate")
+
+PROMOTION_LETTERS = {2: "q", 3: "r", 4: "b", 5: "n"}
+SQUARE_INDEX = {name: i for i, name in enumerate(chess.SQUARE_NAMES)}
+
+
+def uci_move(move):
+    """e2e4, or e7e8q for a promotion"""
+    if move is None:
+        return "0000"
+    return chess.SQUARE_NAMES[move.code & 63] + chess.SQUARE_NAMES[move.code >> 6 & 63] + PROMOTION_LETTERS.get(
+        move.code >> 12, ""
+    )
+
+
+def parse_move(game, text):
+    """The legal Move of game written as text, None when there is none"""
+    start = SQUARE_INDEX.get(text[:2])
+    end = SQUARE_INDEX.get(text[2:4])
+    prom = chess.PROMOTION_CODES.get(text[4:5].upper() or None)
+    if start is None or end is None or prom is None:
+        return None
+    code = chess.encode_move(start, end, prom)
+    if code not in game.legal_codes():
+        return None
+    return chess.Move.decode(code)
+
+
+def uci_score(score):
+    """score cp <centipawns>, or score mate <moves>, negative when mated"""
+    if abs(score) >= search.MATE - 1000:
+        plies = search.MATE - abs(score)
+        moves = (plies + 1) // 2
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {int(round(score))}"
+
+
+def time_budget(time_left, increment=0.0, moves_to_go=None):
+    """(soft, hard) seconds for a move with time_left on the clock.
+
+    The clock is shared evenly over the moves still to play, plus most of
+    the increment. No new depth is started once half the soft time is used,
+    as the next one would take longer than the rest. The hard limit stops a
+    search that is running long anyway, at 4 times the soft time, and never
+    uses more than half the clock unless the time control ends with this move.
+    """
+    moves = moves_to_go or DEFAULT_MOVES_TO_GO
+    usable = max(time_left - MOVE_OVERHEAD, 0.01)
+    soft = usable / moves + 0.75 * increment
+    hard = min(4 * soft, usable * (0.9 if moves == 1 else 0.5))
+    return min(soft, hard), hard
+
+
+class Engine:
+    """Runs UCI commands, one line at a time through handle"""
+
+    def __init__(self, evaluate=search.material, out=None, hash_mb=DEFAULT_HASH_MB):
+        self.out = out or sys.stdout
+        self.searcher = search.Searcher(evaluate, tt_size=self._tt_entries(hash_mb))
+        self.game = chess.Game()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _tt_entries(hash_mb):
+        return max(1, hash_mb * 1024 * 1024 // TT_ENTRY_BYTES)
+
+    def send(self, line):
+        with self._lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def handle(self, line):
+        """Runs one command, returns False on quit"""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max 4096")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self._set_option(args)
+        elif command == "ucinewgame":
+            self.stop()
+            self.searcher.tt.clear()
+            self.game = chess.Game()
+        elif command == "position":
+            self.stop()
+            self._position(args)
+        elif command == "go":
+            self.stop()
+            self._go(args)
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        elif command == "d":
+            self.send(f"info string {self.game.fen(standard=True)}")
+        else:
+            self.send(f"info string unknown command {command}")
+        return True
+
+    def _set_option(self, args):
+        # setoption name <name> value <value>
+        if "value" not in args:
+            return
+        split = args.index("value")
+        name = " ".join(args[1:split]).lower()
+        value = " ".join(args[split + 1 :])
+        if name == "hash":
+            self.stop()
+            self.searcher.tt = search.TranspositionTable(self._tt_entries(int(value)))
+
+    def _position(self, args):
+        if args and args[0] == "startpos":
+            game = chess.Game()
+            rest = args[1:]
+        elif args and args[0] == "fen":
+            end = args.index("moves") if "moves" in args else len(args)
+            game = chess.Game(" ".join(args[1:end]))
+            rest = args[end:]
+        else:
+            self.send("info string position needs startpos or fen")
+            return
+        if rest and rest[0] == "moves":
+            for text in rest[1:]:
+                move = parse_move(game, text)
+                if move is None:
+                    self.send(f"info string illegal move {text}")
+                    break
+                game.push(move)
+        self.game = game
+
+    def _go(self, args):
+        limits = {}
+        root_moves = []
+        i = 0
+        while i < len(args):
+            name = args[i]
+            i += 1
+            if name == "infinite":
+                limits[name] = True
+            elif name == "searchmoves":
+                while i < len(args) and args[i] not in GO_KEYWORDS:
+                    move = parse_move(self.game, args[i])
+                    if move is None:
+                        self.send(f"info string illegal move {args[i]}")
+                    else:
+                        root_moves.append(move.code)
+                    i += 1
+            elif name in GO_NUMBERS and i < len(args) and args[i].lstrip("-").isdigit():
+                limits[name] = int(args[i])
+                i += 1
+
+        depth = limits.get("depth")
+        nodes = limits.get("nodes")
+        infinite = bool(limits.get("infinite"))
+        soft = hard = None
+        if "movetime" in limits:
+            hard = max(limits["movetime"] / 1000 - MOVE_OVERHEAD, 0.001)
+        elif not infinite:
+            clock, increment = ("wtime", "winc") if self.game.on_move == 1 else ("btime", "binc")
+            if clock in limits:
+                soft, hard = time_budget(
+                    limits[clock] / 1000, limits.get(increment, 0) / 1000, limits.get("movestogo")
+                )
+            elif not (depth or nodes):
+                soft, hard = time_budget(DEFAULT_CLOCK, limits.get(increment, 0) / 1000, limits.get("movestogo"))
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._search,
+            args=(self.game, depth, nodes, soft, hard, infinite, root_moves),
+            name="search",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _search(self, game, depth, nodes, soft, hard, infinite, root_moves):
+        def on_info(result):
+            elapsed = max(result.elapsed, 1e-6)
+            pv = " ".join(uci_move(move) for move in result.pv)
+            self.send(
+                f"info depth {result.depth} score {uci_score(result.score)} nodes {result.nodes} "
+                f"nps {int(result.nodes / elapsed)} time {int(elapsed * 1000)} pv {pv}"
+            )
+            # a stop that came before the search started, or the next depth
+            # would most likely not finish in the time left
+            if self._stop.is_set() or (soft is not None and result.elapsed >= soft / 2):
+                self.searcher.stop()
+
+        result = self.searcher.search(
+            game, depth=depth, nodes=nodes, movetime=hard, on_info=on_info, root_moves=root_moves
+        )
+        if infinite:
+            # go infinite may only answer after stop, even when done early
+            self._stop.wait()
+        self.send(f"bestmove {uci_move(result.move)}")
+
+    def stop(self):
+        """Ends a running search, it answers with its bestmove"""
+        self._stop.set()
+        self.searcher.stop()
+        self.wait()
+
+    def wait(self):
+        """Waits for a running search to finish"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UCI engine")
+    parser.add_argument("--weights", help="NumpyModel weights of an EvalAgent, material count without")
+    parser.add_argument("--inputs", default="squares", help="input encoding of the weights, squares or pieces")
+    parser.add_argument("--hash", type=int, default=DEFAULT_HASH_MB, help="transposition table size in MB")
+    args = parser.parse_args(argv)
+
+    evaluate = search.material
+    if args.weights:
+        # the agent lives next to the chess package, not in it
+        import evalagent
+
+        agent = evalagent.EvalAgent(backend="numpy", weights=args.weights, inputs=args.inputs)
+        if args.inputs == "pieces":
+            evaluate = search.nnue_evaluator(agent)
+        else:
+            evaluate = search.agent_evaluator(agent)
+
+    engine = Engine(evaluate, hash_mb=args.hash)
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+
+
+if __name__ == "__main__":
+    main()
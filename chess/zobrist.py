@@ -0,0 +1,50 @@
+"""Zobrist keys, a 64 bit hash of a position.
+
+The key of a position is the xor of a random number for every piece on its
+square, one for black to move, one for each castle right and one for the file
+of the en passent square when a pawn can actually take there. Moves change
+only a few of these, so the key is kept up to date by xoring them in and out.
+The numbers come from a fixed seed, keys stay the same between runs.
+"""
+
+import random
+
+from chess import attacks, bitboard, pieces
+
+_random = random.Random(20201)
+
+# Indexed by piece code like Board.bitboards, then by square index
+PIECE_KEYS = [[_random.getrandbits(64) for _ in range(64)] for _ in range(13)]
+SIDE_KEY = _random.getrandbits(64)
+CASTLE_KEYS = {right: _random.getrandbits(64) for right in "KQkq"}
+EP_FILE_KEYS = [_random.getrandbits(64) for _ in range(8)]
+
+
+def ep_key(board, ep, on_move):
+    """The en passent part of the key, only set when on_move can take on ep"""
+    if ep is None:
+        return 0
+    if attacks.PAWN_ATTACKS[-on_move][ep] & board.bitboards[pieces.PAWN * on_move]:
+        return EP_FILE_KEYS[ep & 7]
+    return 0
+
+
+def board_key(board):
+    key = 0
+    for index in bitboard.scan(board.occupied):
+        key ^= PIECE_KEYS[board.mailbox[index]][index]
+    return key
+
+
+def state_key(game):
+    """Everything but the pieces: side to move, castle rights and en passent"""
+    key = SIDE_KEY if game.on_move == -1 else 0
+    for right, allowed in game.castles.items():
+        if allowed:
+            key ^= CASTLE_KEYS[right]
+    return key ^ ep_key(game.board, game.board.ep, game.on_move)
+
+
+def game_key(game):
+    """The key of game worked out from scratch"""
+    return board_key(game.board) ^ state_key(game)
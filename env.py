@@ -1,17 +1,34 @@
+import numpy as np
+
 import chess
 import evalagent
 
 
+def terminal_result(game, legal_codes):
+    """1, -1 or 0 if game is over, None while it goes on. legal_codes are the
+    legal move codes of game, which the caller usually has at hand anyway."""
+    if not legal_codes:
+        return -game.on_move if game.in_check else 0
+    if game.is_draw():
+        return 0
+    return None
+
+
 class ChessEnvironment:
-    def __init__(self):
+    def __init__(self, agent=None, with_agent=True):
+        """agent evaluates the positions after every move, a new EvalAgent
+        when left out. with_agent=False runs without evaluations at all."""
         self.game = chess.Game()
         self.move_list = []
         self.possible_moves = []  # Move objects
-        self.agent = evalagent.EvalAgent()
+        if agent is None and with_agent:
+            agent = evalagent.EvalAgent()
+        self.agent = agent
         self.reset()
 
     def reset(self):
         self.game = chess.Game()
+        self.move_list = []
         self.get_possible_moves()
 
     def load_from_fen(self, fen):
@@ -30,17 +47,22 @@ class ChessEnvironment:
                 prom = move[4]
             move_o = chess.Move(start, end, prom=prom)
             if move_o in self.possible_moves:
-                self.game = self.game.move(move_o)
+                self.game.push(move_o)
                 self.move_list.append(move)
                 self.after_move()
                 return True
         return False
 
     def print_evals(self):
-        boards = []
-        for move in self.possible_moves:
-            game = self.game.move(move)
-            boards.append(game.board.squares)
+        if self.agent is None:
+            return
+        # each move is played and taken back, copying the game would copy
+        # its whole history for every move
+        boards = np.zeros((len(self.possible_moves), 64))
+        for i, move in enumerate(self.possible_moves):
+            self.game.push(move)
+            self.game.board.write_squares(boards[i])
+            self.game.pop()
         evals = self.agent.eval(boards)
         for i in range(len(self.possible_moves)):
             print(f"{self.possible_moves[i]}, eval = {evals[i]}")
@@ -50,7 +72,6 @@ class ChessEnvironment:
 
     def after_move(self):
         self.get_possible_moves()
-        self.print_evals()
 
     @property
     def possible_moves_str(self):
@@ -65,10 +86,95 @@ class ChessEnvironment:
 
     @property
     def result(self):
-        return 1
+        """1 when white won, -1 when black won, 0 for a draw, None while playing"""
+        return self.game.result()
+
+    @property
+    def history(self):
+        """Zobrist keys of the positions of the game so far, see Game.history"""
+        return self.game.history
 
     # NN stuff
     @property
     def observation_spec(self):
         return [64, 1]
 
+
+class VectorChessEnvironment:
+    """Steps n games at once.
+
+    Actions are move codes (see chess.encode_move), one per game. Observations
+    are written into one preallocated (n, 64) array, the same 64 squares as
+    Board.squares, which is updated in place on every step rather than copied.
+    A game that ends is reset straight away, its reward and done flag for
+    that step tell the caller it ended.
+    """
+
+    def __init__(self, n, max_plies=None, fen=None):
+        self.n = n
+        self.max_plies = max_plies
+        self.fen = fen
+        self.games = [None] * n
+        self.legal_codes = [None] * n
+        self.plies = np.zeros(n, dtype=np.int32)
+        self.observations = np.zeros((n, 64), dtype=float)
+        self.rewards = np.zeros(n, dtype=float)
+        self.dones = np.zeros(n, dtype=bool)
+        self.games_finished = 0
+        self.reset()
+
+    @property
+    def observation_spec(self):
+        return [self.n, 64]
+
+    def reset(self):
+        for i in range(self.n):
+            self._reset_game(i)
+        return self.observations
+
+    def _reset_game(self, i):
+        self.games[i] = chess.Game(self.fen)
+        self.plies[i] = 0
+        self._observe(i)
+
+    def _observe(self, i):
+        game = self.games[i]
+        game.board.write_squares(self.observations[i])
+        self.legal_codes[i] = game.legal_codes()
+
+    def _result(self, i):
+        """1, -1 or 0 when game i is over, None while it goes on"""
+        result = terminal_result(self.games[i], self.legal_codes[i])
+        if result is not None:
+            return result
+        if self.max_plies is not None and self.plies[i] >= self.max_plies:
+            return 0
+        return None
+
+    def step(self, actions):
+        """Plays actions[i] in game i, returns (observations, rewards, dones).
+
+        Rewards are from white's point of view and only set on the step a
+        game ends. The arrays are reused, copy them to keep them around.
+        """
+        self.rewards[:] = 0
+        self.dones[:] = False
+        for i in range(self.n):
+            code = int(actions[i])
+            if code not in self.legal_codes[i]:
+                raise ValueError(f"{chess.Move.decode(code)} is not legal in game {i}")
+            self.games[i].push(chess.Move.decode(code))
+            self.plies[i] += 1
+            self._observe(i)
+            result = self._result(i)
+            if result is not None:
+                self.rewards[i] = result
+                self.dones[i] = True
+                self.games_finished += 1
+                self._reset_game(i)
+        return self.observations, self.rewards, self.dones
+
+    def random_actions(self, rng=None):
+        """A random legal move code for every game"""
+        rng = rng or np.random.default_rng()
+        return np.array([codes[rng.integers(len(codes))] for codes in self.legal_codes], dtype=np.int32)
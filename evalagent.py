@@ -1,34 +1,322 @@
 # from env import ChessEnvironment
 
-import tensorflow as tf
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
 import numpy as np
 
+from chess import instrument, nnue
+from numpymodel import NumpyModel
+
 buffer_max_length = 10000
 
+# TensorFlow takes seconds to import, it is only loaded once a model is needed
+tf = None
+
+
+def import_tf():
+    global tf
+    if tf is None:
+        import tensorflow
+
+        tf = tensorflow
+    return tf
+
+
+BACKENDS = ("tf", "numpy")
+# Network input for each encoding: the 64 squares as piece codes, or the
+# piece-square one-hot features of chess.nnue
+INPUTS = {"squares": 64, "pieces": nnue.FEATURES}
+
 
 class EvalAgent:
-    def __init__(self):
+    """Evaluates boards with a small dense network.
+
+    Nothing is built until the first eval (or an explicit create_model), so
+    making an agent is cheap. With backend="numpy" and a weights file saved by
+    NumpyModel.save TensorFlow is never imported at all. Whatever the inputs,
+    eval and train_on_batch take boards as 64 squares, train_on_batch also
+    takes them encoded already.
+    """
+
+    def __init__(self, backend="tf", weights=None, inputs="squares"):
+        """backend picks what eval runs on, "tf" for the keras model or "numpy"
+        for a NumpyModel copy of its weights. inputs="pieces" feeds the
+        network piece-square features, which search.nnue_evaluator can keep
+        up to date move by move."""
+        if backend not in BACKENDS:
+            raise ValueError(f"{backend} is not a backend, use one of {BACKENDS}")
+        if inputs not in INPUTS:
+            raise ValueError(f"{inputs} is not an input encoding, use one of {tuple(INPUTS)}")
         # self.env = ChessEnvironment()
-        self.nn = None
-        self.create_model()
+        self.backend = backend
+        self.inputs = inputs
+        self._nn = None
+        self.np_model = None
+        if weights is not None:
+            self.np_model = NumpyModel.load(weights)
+
+    @property
+    def nn(self):
+        if self._nn is None:
+            self.create_model()
+        return self._nn
+
+    @nn.setter
+    def nn(self, model):
+        self._nn = model
 
     def create_model(self):
-        inputs = tf.keras.Input(shape = (64,), dtype=float, name = "input")
-        l1 = tf.keras.layers.Dense(64, input_shape=(64,), activation="sigmoid", dtype=float, name = "l1")(inputs)
+        tf = import_tf()
+        size = INPUTS[self.inputs]
+        inputs = tf.keras.Input(shape = (size,), dtype=float, name = "input")
+        l1 = tf.keras.layers.Dense(64, input_shape=(size,), activation="sigmoid", dtype=float, name = "l1")(inputs)
         l2 = tf.keras.layers.Dense(32, input_shape=(64,), activation="sigmoid", dtype=float, name = "l2")(l1)
         l3 = tf.keras.layers.Dense(16, input_shape=(32,), activation="sigmoid", dtype=float, name = "l3")(l2)
         output = tf.keras.layers.Dense(1, input_shape=(16,), activation="sigmoid", dtype=float, name = "output")(l3)
         model = tf.keras.Model(inputs=inputs, outputs=output, name="eval_model")
         self.nn = model
+        if self.np_model is None:
+            self.sync_numpy()
+        else:
+            # weights given to __init__, keras must run them too
+            self.np_model.to_keras(model)
+
+    def sync_numpy(self):
+        """Copies the keras weights to the numpy backend, call after training"""
+        self.np_model = NumpyModel.from_keras(self.nn)
 
+    def encode(self, boards):
+        """boards as the network takes them"""
+        if self.inputs == "pieces":
+            return nnue.encode(boards)
+        return boards
+
+    @instrument.timed("eval")
     def eval(self, boards):
-        dat = tf.convert_to_tensor(boards, dtype=float)
+        instrument.count("eval.boards", len(boards))
+        boards = self.encode(boards)
+        if self.backend == "numpy":
+            if self.np_model is None:
+                self.sync_numpy()
+            return self.np_model.predict(boards)
+        dat = import_tf().convert_to_tensor(boards, dtype=float)
         return self.nn.predict(dat)
 
+    def compare_backends(self, boards):
+        """Largest difference between the tf and numpy evals of boards"""
+        boards = self.encode(boards)
+        dat = import_tf().convert_to_tensor(boards, dtype=float)
+        tf_evals = self.nn.predict(dat)
+        if self.np_model is None:
+            self.sync_numpy()
+        np_evals = self.np_model.predict(boards)
+        return float(np.max(np.abs(tf_evals - np_evals)))
+
+    def train_on_batch(self, boards, targets, encoded=False):
+        """One optimizer step on the keras model, returns the loss. With
+        encoded=True boards are the network input already (see encode)."""
+        if self.nn.optimizer is None:
+            self.nn.compile(optimizer="adam", loss="mse")
+        loss = self.nn.train_on_batch(boards if encoded else self.encode(boards), targets)
+        # the numpy copy is out of date, it is made again on its next eval
+        self.np_model = None
+        return loss
+
+    def save(self, path):
+        """Writes path.weights.h5 for keras and path.npz for the numpy backend"""
+        self.nn.save_weights(f"{path}.weights.h5")
+        NumpyModel.from_keras(self.nn).save(f"{path}.npz")
+
     def print_eval(self):
         pass
 
 
-nn = EvalAgent()
-nn.create_model()
-nn.print_eval()
+class BatchedEvaluator:
+    """Collects boards from many callers and evaluates them in one batch.
+
+    Every predict call has a fixed overhead of milliseconds, so boards are
+    queued up and handed to the agent together once batch_size of them are
+    waiting or the first one has waited max_latency seconds. Callers get a
+    Future from submit, or block in eval, which takes and returns the same
+    as EvalAgent.eval so a BatchedEvaluator can be used in place of an agent,
+    for example by several searches running in their own threads.
+    """
+
+    def __init__(self, agent, batch_size=256, max_latency=0.002):
+        self.agent = agent
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.batches = 0
+        self.evaluated = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="batched-eval", daemon=True)
+        self._thread.start()
+
+    def submit(self, board):
+        """Queues one board (64 squares), the Future resolves to its eval.
+        Raises RuntimeError once closed."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("the evaluator is closed")
+            self._queue.put((board, future))
+        return future
+
+    def eval(self, boards):
+        futures = [self.submit(board) for board in boards]
+        return np.array([[future.result()] for future in futures]).reshape(-1, 1)
+
+    def close(self):
+        """Evaluates what is still queued and stops the worker thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.perf_counter() + self.max_latency
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self._evaluate(batch)
+
+    def _evaluate(self, batch):
+        boards = np.stack([np.asarray(board, dtype=float) for board, _ in batch])
+        try:
+            evals = self.agent.eval(boards)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), value in zip(batch, evals):
+            future.set_result(float(value[0]))
+        self.batches += 1
+        self.evaluated += len(batch)
+
+
+class EvalCache:
+    """Least recently used cache of evals in front of an agent.
+
+    Boards are keyed by their 64 squares packed into bytes. With mirror=True
+    a board and its colour flipped mirror image (ranks reversed, colours
+    swapped) share an entry, the mirror gets mirror_value of the eval, by
+    default 1 - eval as the agent scores for white. eval takes and returns the
+    same as EvalAgent.eval so the cache can stand in for the agent.
+    """
+
+    # rough size of one entry: the packed key, the float and the dict node
+    ENTRY_BYTES = 250
+
+    def __init__(self, agent, memory_budget=64 * 1024 * 1024, mirror=False, mirror_value=None):
+        self.agent = agent
+        self.max_entries = max(1, memory_budget // self.ENTRY_BYTES)
+        self.mirror = mirror
+        self.mirror_value = mirror_value or (lambda value: 1.0 - value)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, board):
+        squares = np.asarray(board, dtype=np.int8)
+        key = squares.tobytes()
+        if not self.mirror:
+            return key, False
+        mirrored = squares.reshape(8, 8)[::-1].reshape(64)
+        # the en passent target (7) has no colour
+        mirrored = np.where(mirrored == 7, mirrored, -mirrored).astype(np.int8)
+        mirrored_key = mirrored.tobytes()
+        if mirrored_key < key:
+            return mirrored_key, True
+        return key, False
+
+    def eval(self, boards, keys=None):
+        """Evals of boards, only the ones not in the cache go to the agent.
+
+        keys can give a key per board, a zobrist key for example, instead of
+        packing the squares. Mirroring is not applied to given keys. A board
+        that is in boards more than once goes to the agent once, its repeats
+        count as hits.
+        """
+        if keys is None:
+            keyed = [self._key(board) for board in boards]
+        else:
+            keyed = [(key, False) for key in keys]
+        values = [None] * len(keyed)
+        # the indices of the boards of every key not in the cache
+        missing = {}
+        with self._lock:
+            for i, (key, mirrored) in enumerate(keyed):
+                value = self._entries.get(key)
+                if value is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    values[i] = self.mirror_value(value) if mirrored else value
+            self.hits += len(keyed) - len(missing)
+            self.misses += len(missing)
+        instrument.count("eval_cache.hits", len(keyed) - len(missing))
+        instrument.count("eval_cache.misses", len(missing))
+
+        if missing:
+            evals = self.agent.eval(
+                np.stack([np.asarray(boards[indices[0]], dtype=float) for indices in missing.values()])
+            )
+            with self._lock:
+                for (key, indices), value in zip(missing.items(), evals):
+                    value = float(value[0])
+                    # entries are stored for the board the key was made of
+                    entry = self.mirror_value(value) if keyed[indices[0]][1] else value
+                    self._entries[key] = entry
+                    for i in indices:
+                        values[i] = self.mirror_value(entry) if keyed[i][1] else entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return np.array([[value] for value in values])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
@@ -0,0 +1,100 @@
+"""Runs the dense EvalAgent network with plain NumPy.
+
+The network is a handful of small dense layers, for which TensorFlow spends
+far more time dispatching than calculating. NumpyModel holds the weights as
+arrays and does the forward pass as one matrix product per layer. This module
+never imports TensorFlow, weights saved with save can be loaded in processes
+that do not have it.
+"""
+
+import numpy as np
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def relu(x):
+    return np.maximum(x, 0.0)
+
+
+def tanh(x):
+    return np.tanh(x)
+
+
+def linear(x):
+    return x
+
+
+ACTIVATIONS = {
+    "sigmoid": sigmoid,
+    "relu": relu,
+    "tanh": tanh,
+    "linear": linear,
+}
+
+
+class NumpyModel:
+    def __init__(self, layers):
+        """layers is a list of (weights, bias, activation name) per dense layer"""
+        self.layers = [
+            (np.asarray(w), np.asarray(b), activation) for w, b, activation in layers
+        ]
+        self._activations = [ACTIVATIONS[activation] for _, _, activation in self.layers]
+
+    @classmethod
+    def from_keras(cls, model):
+        """Copies the weights of a keras model made of Dense layers"""
+        layers = []
+        for layer in model.layers:
+            weights = layer.get_weights()
+            if not weights:
+                # the input layer
+                continue
+            w, b = weights
+            layers.append((w, b, layer.get_config()["activation"]))
+        return cls(layers)
+
+    def to_keras(self, model):
+        """Copies these weights into a keras model of the same Dense layers"""
+        dense = [layer for layer in model.layers if layer.get_weights()]
+        if len(dense) != len(self.layers):
+            raise ValueError(f"the model has {len(dense)} dense layers, the weights are for {len(self.layers)}")
+        for layer, (w, b, _) in zip(dense, self.layers):
+            layer.set_weights([w, b])
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        count = len([name for name in data.files if name.startswith("w")])
+        layers = []
+        for i in range(count):
+            layers.append((data[f"w{i}"], data[f"b{i}"], str(data[f"a{i}"])))
+        return cls(layers)
+
+    def save(self, path):
+        arrays = {}
+        for i, (w, b, activation) in enumerate(self.layers):
+            arrays[f"w{i}"] = w
+            arrays[f"b{i}"] = b
+            arrays[f"a{i}"] = np.array(activation)
+        np.savez(path, **arrays)
+
+    def predict(self, boards):
+        """Evaluates a batch of boards, returns an (n, 1) array like keras"""
+        x = np.asarray(boards, dtype=self.layers[0][0].dtype)
+        if x.ndim == 1:
+            x = x[np.newaxis]
+        for (w, b, _), activation in zip(self.layers, self._activations):
+            x = activation(x @ w + b)
+        return x
+
+    def predict_from_first_layer(self, x):
+        """Evaluates from the output of the first layer before its activation,
+        as kept by a chess.nnue.Accumulator, returns an (n, 1) array"""
+        x = self._activations[0](np.asarray(x, dtype=self.layers[0][0].dtype))
+        if x.ndim == 1:
+            x = x[np.newaxis]
+        for (w, b, _), activation in zip(self.layers[1:], self._activations[1:]):
+            x = activation(x @ w + b)
+        return x
@@ -0,0 +1,172 @@
+"""Replay memory for EvalAgent training.
+
+Observations, targets and priorities live in arrays allocated up front, new
+positions overwrite the oldest once the buffer is full. Sampling is uniform
+or proportional to priority through a sum tree, and both return contiguous
+arrays ready for the model. Given a directory the arrays are memory mapped
+files instead, so the buffer can be larger than memory.
+"""
+
+import os
+
+import numpy as np
+
+
+class SumTree:
+    """Binary tree over the priorities where each node holds the sum of its
+    children, so a prefix sum can be found in log(n) steps.
+
+    Stored as one array: the root at 1, the children of node i at 2i and
+    2i + 1, the leaves at size to 2 * size - 1. Updates and lookups work on
+    whole arrays of indices at once, a level at a time.
+    """
+
+    def __init__(self, capacity, tree=None):
+        """tree is an array of tree_length(capacity) zeros to keep the tree
+        in, a new one without"""
+        self.size = 1 << max(capacity - 1, 1).bit_length()
+        self.depth = self.size.bit_length() - 1
+        self.tree = tree if tree is not None else np.zeros(self.tree_length(capacity), dtype=np.float64)
+
+    @staticmethod
+    def tree_length(capacity):
+        return 2 << max(capacity - 1, 1).bit_length()
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.size
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def get(self, indices):
+        return self.tree[np.asarray(indices) + self.size]
+
+    def find(self, values):
+        """Leaf index for every prefix sum in values"""
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = self.tree[2 * nodes]
+            right = values >= left
+            values -= left * right
+            nodes = 2 * nodes + right
+        return nodes - self.size
+
+
+class ReplayBuffer:
+    def __init__(
+        self,
+        capacity=10000,  # evalagent.buffer_max_length
+        obs_shape=(64,),
+        obs_dtype=np.int8,
+        prioritized=False,
+        alpha=0.6,
+        path=None,
+    ):
+        """With path the arrays are memory mapped .npy files in that
+        directory, np.load reads them back.
+
+        The files are made anew, the position and count of a buffer are not
+        kept, so FileExistsError is raised when path already holds a buffer
+        rather than writing over it.
+        """
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.position = 0
+        self.count = 0
+        self.max_priority = 1.0
+        if path is not None and os.path.exists(os.path.join(path, "observations.npy")):
+            raise FileExistsError(f"{path} already holds a replay buffer")
+        self.observations = self._array("observations", (capacity,) + tuple(obs_shape), obs_dtype, path)
+        self.targets = self._array("targets", (capacity,), np.float32, path)
+        self.priorities = None
+        if prioritized:
+            tree = self._array("priorities", (SumTree.tree_length(capacity),), np.float64, path)
+            self.priorities = SumTree(capacity, tree=tree)
+
+    @staticmethod
+    def _array(name, shape, dtype, path):
+        if path is None:
+            return np.zeros(shape, dtype=dtype)
+        os.makedirs(path, exist_ok=True)
+        return np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, observation, target, priority=None):
+        i = self.position
+        self.observations[i] = observation
+        self.targets[i] = target
+        if self.prioritized:
+            if priority is None:
+                priority = self.max_priority
+            self.priorities.update([i], [priority ** self.alpha])
+        self.position = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, observations, targets, priorities=None):
+        """Appends a batch, wrapping around the end of the buffer"""
+        observations = np.asarray(observations)
+        n = len(observations)
+        if n > self.capacity:
+            # only the newest fit
+            observations = observations[-self.capacity :]
+            targets = np.asarray(targets)[-self.capacity :]
+            if priorities is not None:
+                priorities = np.asarray(priorities)[-self.capacity :]
+            n = self.capacity
+        indices = (self.position + np.arange(n)) % self.capacity
+        self.observations[indices] = observations
+        self.targets[indices] = targets
+        if self.prioritized:
+            if priorities is None:
+                priorities = np.full(n, self.max_priority)
+            self.priorities.update(indices, np.asarray(priorities, dtype=np.float64) ** self.alpha)
+        self.position = (self.position + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def sample(self, batch_size, rng=None, beta=0.4):
+        """Returns (observations, targets, indices, weights).
+
+        Uniform unless the buffer is prioritized, then positions are drawn
+        proportional to priority ** alpha and weights are the normalised
+        importance sampling corrections for beta. Uniform weights are all 1.
+        """
+        if self.count == 0:
+            raise ValueError("can not sample from an empty replay buffer")
+        rng = rng or np.random.default_rng()
+        if not self.prioritized:
+            indices = rng.integers(0, self.count, size=batch_size)
+            weights = np.ones(batch_size, dtype=np.float32)
+        else:
+            total = self.priorities.total
+            # one draw per equal slice of the total, spreads the batch out
+            values = (np.arange(batch_size) + rng.random(batch_size)) * (total / batch_size)
+            indices = np.minimum(self.priorities.find(values), self.count - 1)
+            probabilities = self.priorities.get(indices) / total
+            weights = (self.count * probabilities) ** -beta
+            weights = (weights / weights.max()).astype(np.float32)
+        return self.observations[indices], self.targets[indices], indices, weights
+
+    def update_priorities(self, indices, priorities):
+        if not self.prioritized:
+            raise ValueError("the replay buffer is not prioritized")
+        priorities = np.asarray(priorities, dtype=np.float64)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.priorities.update(indices, priorities ** self.alpha)
+
+    def flush(self):
+        """Writes memory mapped arrays to disk"""
+        arrays = [self.observations, self.targets]
+        if self.prioritized:
+            arrays.append(self.priorities.tree)
+        for array in arrays:
+            if isinstance(array, np.memmap):
+                array.flush()
@@ -0,0 +1,347 @@
+"""Self-play data generation.
+
+A number of actor processes play games against themselves. For every move an
+actor writes the boards after each of its legal moves into its own slot of a
+shared memory block and asks the inference process to evaluate them. The
+inference process batches the requests of all actors into one eval call on
+an EvalAgent and writes the evals back into shared memory. Finished games are
+written to the output directory as .npz files of their positions, moves and
+result.
+
+Actors that die are restarted, games are written to a temporary file and
+renamed, so a crash never leaves half a game on disk.
+
+    python selfplay.py --actors 8 --out games --duration 3600
+"""
+
+import argparse
+import os
+import queue
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import chess
+from env import ChessEnvironment, terminal_result
+
+# Most legal moves any chess position has is 218
+SLOT_SIZE = 256
+
+
+def _shared_arrays(shm, n_actors):
+    """The boards and values slots of every actor, and the ids of the last
+    request the server answered for each and of the last one each sent"""
+    boards = np.ndarray((n_actors, SLOT_SIZE, 64), dtype=np.float64, buffer=shm.buf)
+    values = np.ndarray(
+        (n_actors, SLOT_SIZE), dtype=np.float64, buffer=shm.buf, offset=boards.nbytes
+    )
+    answered = np.ndarray((n_actors,), dtype=np.int64, buffer=shm.buf, offset=boards.nbytes + values.nbytes)
+    sent = np.ndarray(
+        (n_actors,), dtype=np.int64, buffer=shm.buf, offset=boards.nbytes + values.nbytes + answered.nbytes
+    )
+    return boards, values, answered, sent
+
+
+def _shared_size(n_actors):
+    return n_actors * SLOT_SIZE * (64 + 1) * 8 + 2 * n_actors * 8
+
+
+def inference_server(shm_name, n_actors, requests, ready, stop, agent_kwargs, batch_size, max_latency):
+    """Evaluates the requests of all actors, batched.
+
+    Requests are (actor, count, request id). An actor sends the same request
+    again when it waits too long, so a request whose id was answered already,
+    or is older than one seen from that actor, is a stale copy and skipped
+    without reading the slot, which the actor may be filling for its next
+    request by then.
+    """
+    import evalagent
+
+    agent = evalagent.EvalAgent(**agent_kwargs)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    boards, values, answered, _ = _shared_arrays(shm, n_actors)
+    latest = {}
+
+    def is_current(request):
+        actor, _, request_id = request
+        if request_id <= answered[actor] or request_id < latest.get(actor, 0):
+            return False
+        latest[actor] = request_id
+        return True
+
+    try:
+        while not stop.is_set():
+            try:
+                request = requests.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if request is None:
+                break
+            if not is_current(request):
+                continue
+            batch = {request[0]: request}
+            count = request[1]
+            deadline = time.perf_counter() + max_latency
+            while count < batch_size:
+                try:
+                    request = requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop.set()
+                    break
+                if not is_current(request) or batch.get(request[0]) == request:
+                    continue
+                if request[0] in batch:
+                    count -= batch[request[0]][1]
+                batch[request[0]] = request
+                count += request[1]
+            batch = list(batch.values())
+            evals = agent.eval(np.concatenate([boards[actor, :k] for actor, k, _ in batch]))
+            start = 0
+            for actor, k, request_id in batch:
+                values[actor, :k] = evals[start : start + k, 0]
+                start += k
+                # the values are written before the id that says they are there
+                answered[actor] = request_id
+                ready[actor].set()
+    finally:
+        del boards, values, answered
+        shm.close()
+
+
+def actor(actor_id, shm_name, n_actors, requests, ready, stop, out_dir, stats, temperature, max_plies, seed):
+    """Plays games until stop is set, picking moves by the evals of the children"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    boards, values, answered, sent = _shared_arrays(shm, n_actors)
+    boards, values = boards[actor_id], values[actor_id]
+    ready = ready[actor_id]
+    # a restarted actor goes on after every id its predecessor sent, an
+    # answer to one of those may still come and must not match a new request
+    request_id = int(sent[actor_id])
+    rng = np.random.default_rng(seed)
+    env = ChessEnvironment(with_agent=False)
+    decode = chess.Move.decode
+    game_count = 0
+    try:
+        while not stop.is_set():
+            env.reset()
+            game = env.game
+            positions = []
+            moves = []
+            while True:
+                codes = game.legal_codes()
+                result = terminal_result(game, codes)
+                if result is None and len(moves) >= max_plies:
+                    result = 0
+                if result is not None:
+                    break
+                for j, code in enumerate(codes):
+                    game.push(decode(code))
+                    game.board.write_squares(boards[j])
+                    game.pop()
+                request_id += 1
+                if not _request(actor_id, request_id, len(codes), requests, ready, answered, sent, stop):
+                    return
+                # evals are for white, the side on move wants them high
+                scores = values[: len(codes)] if game.on_move == 1 else 1.0 - values[: len(codes)]
+                code = codes[_pick(scores, temperature, rng)]
+                positions.append(game.board.squares.astype(np.int8))
+                moves.append(code)
+                game.push(decode(code))
+                with stats["positions"].get_lock():
+                    stats["positions"].value += len(codes)
+            _write_game(out_dir, f"{actor_id}-{os.getpid()}-{game_count}", positions, moves, result)
+            game_count += 1
+            with stats["games"].get_lock():
+                stats["games"].value += 1
+    finally:
+        del boards, values, answered, sent
+        shm.close()
+
+
+def _request(actor_id, request_id, count, requests, ready, answered, sent, stop):
+    """Asks for evals of the first count boards of the slot and waits until
+    the server says it answered request_id. The slot must not change before
+    then. The request is sent again if the server does not answer, it might
+    have been restarted. Returns False when stopping."""
+    ready.clear()
+    sent[actor_id] = request_id
+    requests.put((actor_id, count, request_id))
+    while answered[actor_id] != request_id:
+        if ready.wait(timeout=1.0):
+            # set by this answer, or by one to a stale copy of an older request
+            ready.clear()
+            continue
+        if stop.is_set():
+            return False
+        requests.put((actor_id, count, request_id))
+    return True
+
+
+def _pick(scores, temperature, rng):
+    if temperature <= 0:
+        return int(np.argmax(scores))
+    logits = (scores - np.max(scores)) / temperature
+    p = np.exp(logits)
+    return int(rng.choice(len(scores), p=p / p.sum()))
+
+
+def _write_game(out_dir, name, positions, moves, result):
+    path = os.path.join(out_dir, f"game-{name}.npz")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            positions=np.array(positions, dtype=np.int8).reshape(-1, 64),
+            moves=np.array(moves, dtype=np.int16),
+            result=np.int8(result),
+        )
+    os.replace(tmp, path)
+
+
+class SelfPlay:
+    def __init__(
+        self,
+        out_dir,
+        actors=None,
+        agent_kwargs=None,
+        batch_size=1024,
+        max_latency=0.005,
+        temperature=0.1,
+        max_plies=400,
+    ):
+        self.out_dir = out_dir
+        self.n_actors = actors or max(1, os.cpu_count() - 1)
+        self.agent_kwargs = agent_kwargs or {}
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.temperature = temperature
+        self.max_plies = max_plies
+        self.restarts = 0
+
+    def run(self, duration=None, games=None, report_every=10.0, report=print):
+        """Generates games until duration seconds passed or games were made"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        ctx = mp.get_context("spawn")
+        shm = shared_memory.SharedMemory(create=True, size=_shared_size(self.n_actors))
+        self._requests = ctx.Queue()
+        self._ready = [ctx.Event() for _ in range(self.n_actors)]
+        self._stop = ctx.Event()
+        self._stats = {"games": ctx.Value("q", 0), "positions": ctx.Value("q", 0)}
+        self._ctx = ctx
+        self._shm_name = shm.name
+        self._seed = 0
+
+        server = self._start_server()
+        actors = [self._start_actor(i) for i in range(self.n_actors)]
+        start = last_report = time.perf_counter()
+        try:
+            while True:
+                time.sleep(0.2)
+                now = time.perf_counter()
+                done = self._stats["games"].value
+                if duration is not None and now - start >= duration:
+                    break
+                if games is not None and done >= games:
+                    break
+                if not server.is_alive():
+                    server = self._start_server()
+                    self.restarts += 1
+                for i, process in enumerate(actors):
+                    if not process.is_alive():
+                        actors[i] = self._start_actor(i)
+                        self.restarts += 1
+                if now - last_report >= report_every:
+                    report(self.format_stats(now - start))
+                    last_report = now
+        finally:
+            self._stop.set()
+            for process in actors:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self._requests.put(None)
+            server.join(timeout=5)
+            if server.is_alive():
+                server.terminate()
+            shm.close()
+            shm.unlink()
+        report(self.format_stats(time.perf_counter() - start))
+        return self._stats["games"].value
+
+    def format_stats(self, elapsed):
+        games = self._stats["games"].value
+        positions = self._stats["positions"].value
+        elapsed = max(elapsed, 1e-9)
+        return (
+            f"{games} games, {games / elapsed * 3600:.0f} games/hour, "
+            f"{positions / elapsed:.0f} positions/s, {self.restarts} restarts"
+        )
+
+    def _start_server(self):
+        process = self._ctx.Process(
+            target=inference_server,
+            args=(
+                self._shm_name,
+                self.n_actors,
+                self._requests,
+                self._ready,
+                self._stop,
+                self.agent_kwargs,
+                self.batch_size,
+                self.max_latency,
+            ),
+            name="selfplay-inference",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def _start_actor(self, i):
+        self._seed += 1
+        process = self._ctx.Process(
+            target=actor,
+            args=(
+                i,
+                self._shm_name,
+                self.n_actors,
+                self._requests,
+                self._ready,
+                self._stop,
+                self.out_dir,
+                self._stats,
+                self.temperature,
+                self.max_plies,
+                self._seed,
+            ),
+            name=f"selfplay-actor-{i}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates self-play games")
+    parser.add_argument("--out", default="games", help="directory the games are written to")
+    parser.add_argument("--actors", type=int, default=None, help="actor processes, all cores but one by default")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run")
+    parser.add_argument("--games", type=int, default=None, help="games to generate")
+    parser.add_argument("--backend", default="tf", help="EvalAgent backend, tf or numpy")
+    parser.add_argument("--weights", default=None, help="NumpyModel weights for the numpy backend")
+    parser.add_argument("--temperature", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    agent_kwargs = {"backend": args.backend}
+    if args.weights:
+        agent_kwargs["weights"] = args.weights
+    SelfPlay(args.out, actors=args.actors, agent_kwargs=agent_kwargs, temperature=args.temperature).run(
+        duration=args.duration, games=args.games
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Compact on-disk format for training positions.
+
+A shard is a 16 byte header (the magic b"CHSHARD1" and the record count as
+a little endian uint64) followed by fixed size 40 byte records:
+
+    squares  32 bytes, two squares per byte, low nibble first, a1 to h8.
+             A nibble is the piece code + 6, so 0 to 12, and 13 for the
+             en passent target.
+    on_move  int8, 1 or -1
+    castles  uint8, bits 0 to 3 for K, Q, k and q
+    fifty_mr uint8
+    flags    uint8, unused for now
+    value    float32, the training target
+
+That is 40 bytes against the 512 of a float64 Board.squares array. Shards are
+read through np.memmap, a batch is one gather from the map plus a vectorized
+unpack of the nibbles, no Python object is made per position.
+"""
+
+import os
+
+import numpy as np
+
+from chess.fen import CASTLE_BITS
+
+MAGIC = b"CHSHARD1"
+HEADER_BYTES = 16
+RECORD = np.dtype(
+    [
+        ("squares", np.uint8, 32),
+        ("on_move", np.int8),
+        ("castles", np.uint8),
+        ("fifty_mr", np.uint8),
+        ("flags", np.uint8),
+        ("value", "<f4"),
+    ]
+)
+EP_NIBBLE = 7 + 6
+
+
+def pack_squares(squares):
+    """(n, 64) piece codes to (n, 32) uint8 nibbles"""
+    # the en passent target (7) lands on EP_NIBBLE by itself
+    nibbles = (np.asarray(squares).reshape(-1, 64).astype(np.int16) + 6).astype(np.uint8)
+    return nibbles[:, 0::2] | (nibbles[:, 1::2] << 4)
+
+
+def unpack_squares(packed, dtype=np.float64):
+    """(n, 32) uint8 nibbles back to (n, 64) piece codes"""
+    packed = np.asarray(packed)
+    nibbles = np.empty((packed.shape[0], 64), dtype=np.int8)
+    nibbles[:, 0::2] = packed & 15
+    nibbles[:, 1::2] = packed >> 4
+    return (nibbles - 6).astype(dtype, copy=False)
+
+
+def castle_bits(castles: dict):
+    bits = 0
+    for right, allowed in castles.items():
+        if allowed:
+            bits |= CASTLE_BITS[right]
+    return bits
+
+
+class ShardWriter:
+    """Appends records to a shard file, the header is written on close"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, "wb")
+        self._write_header()
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(MAGIC + np.uint64(self.count).astype("<u8").tobytes())
+        self._file.seek(0, os.SEEK_END)
+
+    def write(self, squares, values, on_move=1, castles=0, fifty_mr=0):
+        """Writes n positions. squares is (n, 64) piece codes as in
+        Board.squares, the others are arrays of n or a single value for all"""
+        squares = np.asarray(squares).reshape(-1, 64)
+        records = np.zeros(len(squares), dtype=RECORD)
+        records["squares"] = pack_squares(squares)
+        records["on_move"] = on_move
+        records["castles"] = castles
+        records["fifty_mr"] = np.minimum(fifty_mr, 255)
+        records["value"] = values
+        self._file.write(records.tobytes())
+        self.count += len(records)
+
+    def write_game(self, game, value):
+        """Writes the position of a chess.Game"""
+        self.write(
+            game.board.squares,
+            [value],
+            on_move=game.on_move,
+            castles=castle_bits(game.castles),
+            fifty_mr=game.fifty_mr,
+        )
+
+    def close(self):
+        self._write_header()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_shard(path):
+    """Memory maps the records of a shard"""
+    with open(path, "rb") as f:
+        header = f.read(HEADER_BYTES)
+    if header[:8] != MAGIC:
+        raise ValueError(f"{path} is not a shard")
+    count = int(np.frombuffer(header[8:], dtype="<u8")[0])
+    if count == 0:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode="r", offset=HEADER_BYTES, shape=(count,))
+
+
+class ShardReader:
+    """Streams shuffled (squares, values) batches from a set of shards.
+
+    Every epoch the order of the shards and of the records within each shard
+    is shuffled. squares come out as (batch_size, 64) arrays of dtype, ready
+    for EvalAgent, values as (batch_size, 1) float32.
+    """
+
+    def __init__(
+        self,
+        paths,
+        batch_size=1024,
+        shuffle=True,
+        seed=None,
+        dtype=np.float64,
+        drop_last=False,
+        part=(0, 1),
+    ):
+        """part=(i, n) reads only the records whose index is i modulo n, so n
+        readers can split the same shards between them"""
+        self.paths = list(paths)
+        self.part = part
+        self.shards = [open_shard(path) for path in self.paths]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.dtype = dtype
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        part, parts = self.part
+        return sum(len(range(part, len(shard), parts)) for shard in self.shards)
+
+    def records(self):
+        """Shuffled record batches, with all fields"""
+        order = self.rng.permutation(len(self.shards)) if self.shuffle else range(len(self.shards))
+        for i in order:
+            shard = self.shards[i]
+            part, parts = self.part
+            indices = np.arange(part, len(shard), parts)
+            if self.shuffle:
+                indices = self.rng.permutation(indices)
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start : start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    break
+                # sorted indices read the map front to back
+                yield shard[np.sort(batch)]
+
+    def batches(self, epochs=1):
+        for _ in range(epochs):
+            for records in self.records():
+                yield unpack_squares(records["squares"], self.dtype), records["value"].reshape(-1, 1)
+
+
+def games_to_shard(game_paths, shard_path):
+    """Converts self-play games (see selfplay.py) to a shard. The value of a
+    position is the result of its game mapped to 0 (black won) to 1 (white won)."""
+    with ShardWriter(shard_path) as writer:
+        for path in game_paths:
+            with np.load(path) as game:
+                positions = game["positions"]
+                value = (float(game["result"]) + 1) / 2
+            on_move = np.where(np.arange(len(positions)) % 2 == 0, 1, -1)
+            writer.write(positions, np.full(len(positions), value), on_move=on_move)
+    return writer.count
@@ -0,0 +1,181 @@
+"""Trains the EvalAgent network on shards of positions (see shards.py).
+
+Reading, unpacking and encoding batches for the network input happens in
+worker processes that each take a share of the records and keep a bounded
+queue of batches filled ahead of the optimizer, the main process only runs
+the training steps. It reports samples
+per second and how the time splits between waiting for data and computing,
+and checkpoints the weights every so often.
+
+    python train.py data/*.shard --epochs 3 --checkpoint checkpoints/eval
+    python train.py data/*.shard --inputs pieces     # for search.nnue_evaluator
+"""
+
+import argparse
+import glob
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import numpy as np
+
+from chess import nnue
+from shards import ShardReader
+
+
+def _produce(paths, batch_size, seed, epochs, part, inputs, batches, stop):
+    reader = ShardReader(paths, batch_size=batch_size, seed=seed, part=part, dtype=np.float32)
+    try:
+        for x, y in reader.batches(epochs):
+            if inputs == "pieces":
+                x = nnue.encode(x)
+            while not stop.is_set():
+                try:
+                    batches.put((x, y), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+    finally:
+        batches.put(None)
+
+
+class Prefetcher:
+    """Iterates over (x, y) batches made by worker processes.
+
+    Every worker reads all shards but only its part of the records, with its
+    own shuffle seed. At most prefetch batches wait in the queue. x is in the
+    network input of inputs, as EvalAgent.encode gives it.
+    """
+
+    def __init__(self, paths, batch_size=1024, epochs=1, workers=None, prefetch=16, seed=0, inputs="squares"):
+        self.paths = list(paths)
+        self.inputs = inputs
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.workers = workers or max(1, os.cpu_count() - 1)
+        self.prefetch = prefetch
+        self.seed = seed
+        self._processes = []
+
+    def __iter__(self):
+        ctx = mp.get_context("spawn")
+        batches = ctx.Queue(maxsize=self.prefetch)
+        stop = ctx.Event()
+        self._processes = [
+            ctx.Process(
+                target=_produce,
+                args=(
+                    self.paths,
+                    self.batch_size,
+                    self.seed + i,
+                    self.epochs,
+                    (i, self.workers),
+                    self.inputs,
+                    batches,
+                    stop,
+                ),
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+        for process in self._processes:
+            process.start()
+        running = self.workers
+        try:
+            while running:
+                item = batches.get()
+                if item is None:
+                    running -= 1
+                    continue
+                yield item
+        finally:
+            stop.set()
+            # let workers blocked on a full queue get out
+            while any(process.is_alive() for process in self._processes):
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            for process in self._processes:
+                process.join()
+
+
+class Trainer:
+    def __init__(self, agent, checkpoint=None, checkpoint_every=600.0, report_every=10.0, report=print):
+        """agent needs train_on_batch(x, y, encoded=True) and, to checkpoint,
+        save(path), the batches are encoded for its input already"""
+        self.agent = agent
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.report_every = report_every
+        self.report = report
+        self.samples = 0
+        self.steps = 0
+        self.data_time = 0.0
+        self.compute_time = 0.0
+
+    def fit(self, batches):
+        """Trains on every batch, returns the last loss"""
+        start = last_report = last_checkpoint = time.perf_counter()
+        loss = None
+        waiting = time.perf_counter()
+        for x, y in batches:
+            got_batch = time.perf_counter()
+            self.data_time += got_batch - waiting
+            loss = self.agent.train_on_batch(x, y, encoded=True)
+            waiting = time.perf_counter()
+            self.compute_time += waiting - got_batch
+            self.samples += len(x)
+            self.steps += 1
+
+            if waiting - last_report >= self.report_every:
+                self.report(self.format_stats(waiting - start, loss))
+                last_report = waiting
+            if self.checkpoint and waiting - last_checkpoint >= self.checkpoint_every:
+                self.save()
+                last_checkpoint = time.perf_counter()
+                waiting = last_checkpoint
+        if self.checkpoint:
+            self.save()
+        self.report(self.format_stats(time.perf_counter() - start, loss))
+        return loss
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.checkpoint) or ".", exist_ok=True)
+        self.agent.save(self.checkpoint)
+
+    def format_stats(self, elapsed, loss):
+        busy = max(self.data_time + self.compute_time, 1e-9)
+        return (
+            f"step {self.steps}, loss {float(np.mean(loss)) if loss is not None else float('nan'):.5f}, "
+            f"{self.samples / max(elapsed, 1e-9):.0f} samples/s, "
+            f"data {100 * self.data_time / busy:.0f}% compute {100 * self.compute_time / busy:.0f}%"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trains the EvalAgent network on shards")
+    parser.add_argument("shards", nargs="+", help="shard files or glob patterns")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=None, help="reader processes, all cores but one by default")
+    parser.add_argument("--prefetch", type=int, default=16, help="batches kept ready")
+    parser.add_argument("--checkpoint", default="checkpoints/eval", help="path prefix for the weights")
+    parser.add_argument("--checkpoint-every", type=float, default=600.0, help="seconds")
+    parser.add_argument(
+        "--inputs", default="squares", choices=("squares", "pieces"), help="input encoding of the network"
+    )
+    args = parser.parse_args(argv)
+
+    import evalagent
+
+    paths = sorted(path for pattern in args.shards for path in glob.glob(pattern))
+    batches = Prefetcher(paths, args.batch_size, args.epochs, args.workers, args.prefetch, inputs=args.inputs)
+    Trainer(evalagent.EvalAgent(inputs=args.inputs), args.checkpoint, args.checkpoint_every).fit(batches)
+
+
+if __name__ == "__main__":
+    main()